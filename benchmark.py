@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tracemalloc
+
+# Benchmarks always run without a real window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+import platformer_game as game_module
+from profiler import percentile
+from platformer_game import (Game, LevelData, HudLabel, ScriptedInput, generate_level_data, level_rng,
+                             prepare_level, draw_background, draw_level, init_game,
+                             SCREEN_WIDTH, SCREEN_HEIGHT, WHITE)
+
+# Stress scenes: extra (platforms, coins, enemies) added on top of level 1
+SCENES = {
+    'level1': (0, 0, 0),
+    'platforms': (2000, 0, 0),
+    'coins': (0, 2000, 0),
+    'enemies': (0, 0, 2000),
+    'mixed': (1000, 1000, 1000),
+}
+
+DEFAULT_TICKS = 600
+DEFAULT_SEED = 1
+# Keeps the player running, jumping and turning around
+BENCHMARK_INPUT = "R*40,RJ*1,R*20,L*40,LJ*1,L*20"
+# Ticks traced for the peak memory measurement, tracing slows everything down
+MEMORY_TICKS = 100
+
+# Level 1 plus the given number of extra platforms, coins and enemies placed at
+# random. The extra platforms go above the ground so the player still lands.
+def create_stress_level(platform_count, coin_count, enemy_count, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    data = generate_level_data(1, level_rng(seed, 1))
+    platforms = list(data.platforms)
+    coins = list(data.coins)
+    enemies = list(data.enemies)
+
+    for _ in range(platform_count):
+        width = rng.randint(40, 200)
+        platforms.append((rng.randint(0, SCREEN_WIDTH - width), rng.randint(60, SCREEN_HEIGHT - 80), width, 20))
+    for _ in range(coin_count):
+        coins.append((rng.randint(10, SCREEN_WIDTH - 10), rng.randint(40, SCREEN_HEIGHT - 70)))
+    for _ in range(enemy_count):
+        x = rng.randint(0, SCREEN_WIDTH - 130)
+        enemies.append((x + 50, rng.randint(40, SCREEN_HEIGHT - 80), x, x + 130))
+    return prepare_level(LevelData(data.width, platforms, coins, enemies))
+
+def create_scene_game(name, seed=DEFAULT_SEED, vectorized=False):
+    game = Game(seed=seed, vectorized=vectorized)
+    game.set_level(1, create_stress_level(*SCENES[name], seed=seed))
+    return game
+
+# Run one scene for a number of ticks, timing every tick's update, collisions
+# and (unless draw is off) a full frame drawn to the dummy display
+def run_scene(name, ticks=DEFAULT_TICKS, seed=DEFAULT_SEED, draw=True, vectorized=False):
+    game = create_scene_game(name, seed, vectorized)
+    input_source = ScriptedInput(BENCHMARK_INPUT)
+    screen = game_module.screen
+    labels = [HudLabel("Score: {}", 36, WHITE, 100, 10), HudLabel("Lives: {}", 36, WHITE, 700, 10)]
+
+    frame_times = []
+    start = time.perf_counter()
+    for _ in range(ticks):
+        frame_start = time.perf_counter()
+        game.step(input_source(game))
+        if draw:
+            game.sync_sprites()
+            camera_x = game.camera_x()
+            draw_background(game.level, screen, game.ticks * 1000 // game.tick_rate, camera_x)
+            draw_level(screen, game, camera_x=camera_x)
+            labels[0].draw(screen, game.score)
+            labels[1].draw(screen, game.lives)
+            pygame.display.flip()
+        frame_times.append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+
+    frame_times.sort()
+    return {
+        'ticks': ticks,
+        'entities': len(game.platforms) + len(game.coins) + len(game.enemies),
+        'ticks_per_second': ticks / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': sum(frame_times) * 1000 / ticks,
+        'p95_ms': percentile(frame_times, 95),
+        'p99_ms': percentile(frame_times, 99),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+# Peak Python heap use while building the scene and running a few ticks
+def measure_peak_memory(name, seed=DEFAULT_SEED, draw=True, vectorized=False):
+    tracemalloc.start()
+    try:
+        game = create_scene_game(name, seed, vectorized)
+        input_source = ScriptedInput(BENCHMARK_INPUT)
+        for _ in range(MEMORY_TICKS):
+            game.step(input_source(game))
+            if draw:
+                game.sync_sprites()
+                camera_x = game.camera_x()
+                draw_level(game_module.screen, game, camera_x=camera_x)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Peak resident set size of the process so far in KB, which unlike
+# tracemalloc includes SDL surfaces, fonts and NumPy buffers. It never goes
+# down, so a scene shows the highest of its own peak and the scenes before it.
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB everywhere else
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_benchmarks(scenes, ticks=DEFAULT_TICKS, seed=DEFAULT_SEED, draw=True, vectorized=False):
+    init_game()
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'ticks': ticks,
+            'seed': seed,
+            'draw': draw,
+            'vectorized': vectorized,
+        },
+        'scenes': {},
+    }
+    for name in scenes:
+        result = run_scene(name, ticks, seed, draw, vectorized)
+        result['python_heap_peak_kb'] = measure_peak_memory(name, seed, draw, vectorized) // 1024
+        results['scenes'][name] = result
+    return results
+
+# Compare against a stored baseline. Returns the scenes whose tick rate dropped
+# by more than threshold percent.
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results['scenes'].items():
+        base = baseline.get('scenes', {}).get(name)
+        if base is None:
+            print(f"{name:>10}: no baseline")
+            continue
+        change = (result['ticks_per_second'] / base['ticks_per_second'] - 1) * 100
+        print(f"{name:>10}: {result['ticks_per_second']:9.0f} ticks/s vs {base['ticks_per_second']:9.0f} "
+              f"({change:+.1f}%), p99 {result['p99_ms']:.2f} ms vs {base['p99_ms']:.2f} ms")
+        if change < -threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless platformer benchmarks")
+    parser.add_argument("--scenes", nargs="+", choices=sorted(SCENES), default=list(SCENES),
+                        help="scenes to run (default: all)")
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS,
+                        help="ticks per scene (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help="seed for the scenes and levels (default: %(default)s)")
+    parser.add_argument("--no-draw", action="store_true", help="only time update and collisions")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="simulate enemies and coins as NumPy arrays")
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against results stored in FILE")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent tick rate drop that counts as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scenes, args.ticks, args.seed, not args.no_draw, args.vectorized)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
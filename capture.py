@@ -0,0 +1,83 @@
+import os
+import queue
+import threading
+
+import pygame
+
+# Frames that can wait for the writer before new ones are dropped
+CAPTURE_BUFFERS = 8
+
+# Records frames without stalling the game. capture() copies a frame into the
+# next free surface of a preallocated ring, which is one blit; a writer thread
+# encodes the copies in order and hands their surfaces back. When every
+# surface is still waiting for the writer the frame is dropped and counted.
+# Paths ending in .rgb get a raw RGB24 stream of back-to-back frames, any
+# other path is a directory that gets a numbered PNG per frame.
+class FrameCapture:
+    def __init__(self, path, surface, buffers=CAPTURE_BUFFERS):
+        # Without a surface to copy into every frame would be dropped, or
+        # wait forever
+        if buffers < 1:
+            raise ValueError(f"Frame capture needs at least one buffer, got {buffers}")
+        self.path = path
+        self.size = surface.get_size()
+        # Same size and pixel format as the captured surface, so copying a
+        # frame needs no conversion
+        self.surfaces = [pygame.Surface(self.size, 0, surface) for _ in range(buffers)]
+        self.free = queue.SimpleQueue()
+        for index in range(buffers):
+            self.free.put(index)
+        # (surface index, frame number), None stops the writer
+        self.pending = queue.SimpleQueue()
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+
+        if path.endswith('.rgb'):
+            self.file = open(path, 'wb')
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.file = None
+        self.thread = threading.Thread(target=self.write_frames, name="frame-capture", daemon=True)
+        self.thread.start()
+
+    # Returns False if the frame had to be dropped. With wait the frame waits
+    # for a free surface instead, for runs that don't need to keep up with
+    # real time.
+    def capture(self, surface, wait=False):
+        try:
+            index = self.free.get(wait)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        self.surfaces[index].blit(surface, (0, 0))
+        self.pending.put((index, self.captured))
+        self.captured += 1
+        return True
+
+    def write_frames(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            index, frame = item
+            surface = self.surfaces[index]
+            if self.file:
+                self.file.write(pygame.image.tobytes(surface, 'RGB'))
+            else:
+                pygame.image.save(surface, os.path.join(self.path, f"frame_{frame:06d}.png"))
+            self.written += 1
+            self.free.put(index)
+
+    # Wait for the frames still queued to be written
+    def close(self):
+        if self.thread is None:
+            return
+        self.pending.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.file:
+            self.file.close()
+
+    def stats(self):
+        return {'captured': self.captured, 'written': self.written, 'dropped': self.dropped}
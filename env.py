@@ -0,0 +1,248 @@
+import os
+import time
+import heapq
+import random
+import argparse
+import multiprocessing
+
+# Environments never open a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from platformer_game import (Game, INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP, PLAYER_SPEED, TERMINAL_VELOCITY,
+                             SCREEN_WIDTH, SCREEN_HEIGHT, TICK_RATE)
+
+# Actions are indices into this list of input bits
+ACTIONS = [
+    0,
+    INPUT_LEFT,
+    INPUT_RIGHT,
+    INPUT_JUMP,
+    INPUT_LEFT | INPUT_JUMP,
+    INPUT_RIGHT | INPUT_JUMP,
+]
+
+# Nearest coins and enemies included in an observation
+OBSERVED_COINS = 3
+OBSERVED_ENEMIES = 3
+# Player x, y, velocity x, velocity y, on ground, lives, coins left, then
+# (dx, dy) per coin and (dx, dy, direction) per enemy
+OBSERVATION_SIZE = 7 + 2 * OBSERVED_COINS + 3 * OBSERVED_ENEMIES
+# Relative position of coins and enemies that aren't there
+MISSING = (1.0, 1.0)
+
+# Reward lost with every life, coins give their score
+LIFE_PENALTY = 50
+# Episodes end after this many ticks even if the game isn't over
+DEFAULT_MAX_TICKS = 3600
+
+# One game as a reset/step environment. Observations are tuples of
+# OBSERVATION_SIZE floats, positions relative to the screen size and the
+# player. Each step repeats the action for frame_skip ticks.
+class PlatformerEnv:
+    def __init__(self, seed=None, level=1, tick_rate=TICK_RATE, max_ticks=DEFAULT_MAX_TICKS, frame_skip=1,
+                 level_width=SCREEN_WIDTH, vectorized=False):
+        # Every reset draws the next game seed from here, so a seeded
+        # environment plays the same sequence of episodes
+        self.rng = random.Random(seed)
+        self.level = level
+        self.tick_rate = tick_rate
+        self.max_ticks = max_ticks
+        self.frame_skip = frame_skip
+        self.level_width = level_width
+        self.vectorized = vectorized
+        self.game = None
+
+    def reset(self, seed=None):
+        if self.game:
+            self.game.release_level()
+        if seed is None:
+            seed = self.rng.getrandbits(64)
+        self.game = Game(self.level, self.tick_rate, seed=seed, vectorized=self.vectorized,
+                         level_width=self.level_width)
+        return self.observe()
+
+    # Returns (observation, reward, done, info)
+    def step(self, action):
+        game = self.game
+        inputs = ACTIONS[action]
+        score = game.score
+        lives = game.lives
+        for _ in range(self.frame_skip):
+            game.step(inputs)
+            if game.game_over or game.ticks >= self.max_ticks:
+                break
+
+        reward = game.score - score - LIFE_PENALTY * (lives - game.lives)
+        done = game.game_over or game.ticks >= self.max_ticks
+        info = {'score': game.score, 'lives': game.lives, 'level': game.level, 'ticks': game.ticks}
+        return self.observe(), reward, done, info
+
+    def observe(self):
+        game = self.game
+        game.sync_sprites()
+        player = game.player
+        world = game.world
+        px, py = player.rect.center
+        observation = [
+            player.rect.x / world.width,
+            player.rect.y / SCREEN_HEIGHT,
+            player.velocity_x / PLAYER_SPEED,
+            player.velocity_y / TERMINAL_VELOCITY,
+            float(player.on_ground),
+            float(game.lives),
+            float(world.coins_remaining),
+        ]
+
+        coins = nearest(world.active_coins, px, py, OBSERVED_COINS)
+        for coin in coins:
+            observation.append((coin.rect.centerx - px) / SCREEN_WIDTH)
+            observation.append((coin.rect.centery - py) / SCREEN_HEIGHT)
+        observation.extend(MISSING * (OBSERVED_COINS - len(coins)))
+
+        enemies = nearest(world.active_enemies, px, py, OBSERVED_ENEMIES)
+        for enemy in enemies:
+            observation.append((enemy.rect.centerx - px) / SCREEN_WIDTH)
+            observation.append((enemy.rect.centery - py) / SCREEN_HEIGHT)
+            observation.append(1.0 if enemy.velocity > 0 else -1.0)
+        observation.extend((*MISSING, 0.0) * (OBSERVED_ENEMIES - len(enemies)))
+        return tuple(observation)
+
+    def close(self):
+        if self.game:
+            self.game.release_level()
+            self.game = None
+
+# The count sprites closest to (x, y), nearest first
+def nearest(sprites, x, y, count):
+    return heapq.nsmallest(count, sprites,
+                           key=lambda sprite: (sprite.rect.centerx - x) ** 2 + (sprite.rect.centery - y) ** 2)
+
+# Steps a list of environments together, starting a new episode in every
+# environment whose episode ended
+def step_all(envs, actions):
+    observations = []
+    rewards = []
+    dones = []
+    for env, action in zip(envs, actions):
+        observation, reward, done, _ = env.step(action)
+        if done:
+            observation = env.reset()
+        observations.append(observation)
+        rewards.append(reward)
+        dones.append(done)
+    return observations, rewards, dones
+
+# Worker process owning one shard of a BatchEnv
+def shard_worker(connection, seeds, options):
+    envs = [PlatformerEnv(seed, **options) for seed in seeds]
+    while True:
+        command, actions = connection.recv()
+        if command == 'reset':
+            connection.send([env.reset() for env in envs])
+        elif command == 'step':
+            connection.send(step_all(envs, actions))
+        else:
+            break
+    connection.close()
+
+# count independent environments stepped as one, environment i seeded with
+# seed + i. With processes > 1 the environments are split into that many
+# shards, each simulated by its own worker process. step() takes one action
+# per environment and returns lists of observations, rewards and done flags;
+# finished episodes are reset right away, so after a done the observation is
+# the first of the next episode.
+class BatchEnv:
+    def __init__(self, count, seed=0, processes=1, **options):
+        self.count = count
+        seeds = [seed + i for i in range(count)]
+        self.envs = []
+        self.workers = []
+        self.shards = []
+        if processes <= 1:
+            self.envs = [PlatformerEnv(env_seed, **options) for env_seed in seeds]
+            return
+
+        processes = min(processes, count)
+        for i in range(processes):
+            shard = seeds[i * count // processes:(i + 1) * count // processes]
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=shard_worker, args=(child, shard, options), daemon=True)
+            worker.start()
+            child.close()
+            self.workers.append((worker, parent))
+            self.shards.append(len(shard))
+
+    def reset(self):
+        if not self.workers:
+            return [env.reset() for env in self.envs]
+        for _, connection in self.workers:
+            connection.send(('reset', None))
+        observations = []
+        for _, connection in self.workers:
+            observations.extend(connection.recv())
+        return observations
+
+    def step(self, actions):
+        if not self.workers:
+            return step_all(self.envs, actions)
+
+        # Send every shard its actions first so they all run at once
+        start = 0
+        for (_, connection), size in zip(self.workers, self.shards):
+            connection.send(('step', actions[start:start + size]))
+            start += size
+        observations = []
+        rewards = []
+        dones = []
+        for _, connection in self.workers:
+            shard_observations, shard_rewards, shard_dones = connection.recv()
+            observations.extend(shard_observations)
+            rewards.extend(shard_rewards)
+            dones.extend(shard_dones)
+        return observations, rewards, dones
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+        for worker, connection in self.workers:
+            connection.send(('close', None))
+            connection.close()
+            worker.join()
+        self.envs = []
+        self.workers = []
+
+# Step a batch with random actions and report the throughput
+def main():
+    parser = argparse.ArgumentParser(description="Run batched platformer environments with random actions")
+    parser.add_argument("--envs", type=int, default=64, help="environments in the batch (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="worker processes to shard the batch across (default: %(default)s)")
+    parser.add_argument("--steps", type=int, default=1000, help="batch steps to run (default: %(default)s)")
+    parser.add_argument("--frame-skip", type=int, default=1, help="ticks per step (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first environment (default: %(default)s)")
+    args = parser.parse_args()
+
+    batch = BatchEnv(args.envs, args.seed, args.processes, frame_skip=args.frame_skip)
+    rng = random.Random(args.seed)
+    try:
+        batch.reset()
+        episodes = 0
+        total_reward = 0
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            actions = [rng.randrange(len(ACTIONS)) for _ in range(args.envs)]
+            _, rewards, dones = batch.step(actions)
+            total_reward += sum(rewards)
+            episodes += sum(dones)
+        elapsed = time.perf_counter() - start
+    finally:
+        batch.close()
+
+    steps = args.steps * args.envs
+    print(f"{steps} steps in {elapsed:.2f}s, {steps / elapsed:.0f} steps/s "
+          f"({steps * args.frame_skip / elapsed:.0f} ticks/s), {episodes} episodes ended, "
+          f"total reward {total_reward}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import mmap
+import struct
+import argparse
+
+# Level files: a header, an index with the offset and record counts of every
+# chunk, then the packed records of each chunk in turn. Loading maps the file
+# and only decodes the chunks that are asked for, so a level costs nothing
+# until its chunks come into view.
+LEVEL_MAGIC = b'PFLV'
+LEVEL_VERSION = 1
+LEVEL_EXTENSION = '.pflv'
+# magic, version, level width, chunk width, chunk count, total coins
+HEADER_FORMAT = struct.Struct('<4sHIIII')
+# offset of the chunk's records, platforms, coins, enemies
+INDEX_FORMAT = struct.Struct('<IHHH')
+# id, x, y, width, height
+PLATFORM_FORMAT = struct.Struct('<Iiiii')
+# id, center x, center y
+COIN_FORMAT = struct.Struct('<Iii')
+# id, x, y, min x, max x
+ENEMY_FORMAT = struct.Struct('<Iiiii')
+
+class LevelFormatError(Exception):
+    pass
+
+# File name of a level inside a level directory
+def level_path(directory, level):
+    return os.path.join(directory, f"level_{level:03d}{LEVEL_EXTENSION}")
+
+# Write a level source (see LevelData) to path. Platforms crossing several
+# chunks are stored once per chunk, with the same id.
+def write_level(path, source):
+    chunks = [source.load_chunk(index) for index in range(source.chunk_count)]
+
+    index = []
+    records = []
+    offset = HEADER_FORMAT.size + INDEX_FORMAT.size * len(chunks)
+    for platforms, coins, enemies in chunks:
+        data = b''.join([
+            b''.join(PLATFORM_FORMAT.pack(i, *spec) for i, spec in platforms),
+            b''.join(COIN_FORMAT.pack(i, *spec) for i, spec in coins),
+            b''.join(ENEMY_FORMAT.pack(i, *spec) for i, spec in enemies),
+        ])
+        index.append(INDEX_FORMAT.pack(offset, len(platforms), len(coins), len(enemies)))
+        records.append(data)
+        offset += len(data)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER_FORMAT.pack(LEVEL_MAGIC, LEVEL_VERSION, source.width, source.chunk_width,
+                                   len(chunks), source.coin_count))
+        f.write(b''.join(index))
+        f.write(b''.join(records))
+
+# A memory-mapped level file. Has the same chunk interface as LevelData and
+# can be streamed by a ChunkedWorld directly.
+class LevelFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise LevelFormatError(f"{path} is empty") from None
+        try:
+            magic, version, self.width, self.chunk_width, self.chunk_count, self.coin_count = \
+                HEADER_FORMAT.unpack_from(self.map, 0)
+        except struct.error:
+            self.close()
+            raise LevelFormatError(f"{path} is too short to be a level") from None
+        if magic != LEVEL_MAGIC:
+            self.close()
+            raise LevelFormatError(f"{path} is not a level file")
+        if version != LEVEL_VERSION:
+            self.close()
+            raise LevelFormatError(f"{path} has unsupported level version {version}")
+        if self.chunk_count == 0 or self.chunk_width == 0 or \
+                HEADER_FORMAT.size + INDEX_FORMAT.size * self.chunk_count > len(self.map):
+            self.close()
+            raise LevelFormatError(f"{path} has a broken chunk index")
+
+    def chunk_of(self, x):
+        return min(max(int(x) // self.chunk_width, 0), self.chunk_count - 1)
+
+    def load_chunk(self, index):
+        offset, platform_count, coin_count, enemy_count = INDEX_FORMAT.unpack_from(
+            self.map, HEADER_FORMAT.size + INDEX_FORMAT.size * index)
+        try:
+            platforms, offset = self.read_records(PLATFORM_FORMAT, offset, platform_count)
+            coins, offset = self.read_records(COIN_FORMAT, offset, coin_count)
+            enemies, offset = self.read_records(ENEMY_FORMAT, offset, enemy_count)
+        except struct.error:
+            raise LevelFormatError(f"{self.path} is truncated in chunk {index}") from None
+        return platforms, coins, enemies
+
+    # count records as (id, spec) pairs starting at offset, and the offset after them
+    def read_records(self, record_format, offset, count):
+        end = offset + record_format.size * count
+        if end > len(self.map):
+            raise struct.error("record out of range")
+        records = [(record[0], record[1:]) for record in record_format.iter_unpack(self.map[offset:end])]
+        return records, end
+
+    def close(self):
+        self.map.close()
+
+# Convert the built-in levels into level files
+def main():
+    from platformer_game import level_generator, parse_level_width
+
+    parser = argparse.ArgumentParser(description="Convert platformer levels to level files")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2],
+                        help="levels to convert (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the coins, enemies and generated levels (default: %(default)s)")
+    parser.add_argument("--width", type=parse_level_width, default=800,
+                        help="width of the generated levels (default: %(default)s)")
+    parser.add_argument("--out", default="levels",
+                        help="directory to write the level files to (default: %(default)s)")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for level in args.levels:
+        data = level_generator.generate(level, args.seed, args.width)
+        path = level_path(args.out, level)
+        write_level(path, data)
+        print(f"Level {level}: {len(data.platforms)} platforms, {len(data.coins)} coins, "
+              f"{len(data.enemies)} enemies in {data.chunk_count} chunks, "
+              f"{os.path.getsize(path)} bytes -> {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import time
+import random
+import asyncio
+import argparse
+
+from server import (MESSAGE_HEADER, MESSAGE_WELCOME, MESSAGE_SNAPSHOT, INPUT_FORMAT, WELCOME_FORMAT,
+                    SNAPSHOT_GAME_OVER, apply_snapshot)
+from platformer_game import INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP
+from profiler import percentile
+
+# Simulated players pick a direction every this many snapshots and
+# sometimes jump, like RandomInput
+HOLD_SNAPSHOTS = 30
+JUMP_CHANCE = 0.05
+
+# What one simulated client saw of its session
+class ClientStats:
+    def __init__(self):
+        self.session = None
+        self.snapshots = 0
+        self.bytes_received = 0
+        # Seconds from sending input bits to the first snapshot that applied them
+        self.latencies = []
+        self.seconds = 0.0
+        self.game_over = False
+        self.score = 0
+        self.entities = 0
+
+    def latency_ms(self, percent):
+        return percentile(sorted(self.latencies), percent)
+
+async def read_message(reader):
+    length, kind = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    return kind, await reader.readexactly(length)
+
+# Play one session with random inputs for the given number of seconds,
+# rebuilding the game state from the delta snapshots
+async def run_client(connect, seconds, seed):
+    stats = ClientStats()
+    rng = random.Random(seed)
+    reader, writer = await connect()
+    entities = {}
+    # Input sequence number -> time sent, until a snapshot acknowledges it
+    pending = {}
+    sequence = 0
+    direction = 0
+    inputs = 0
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < seconds:
+            kind, body = await read_message(reader)
+            stats.bytes_received += MESSAGE_HEADER.size + len(body)
+            if kind == MESSAGE_WELCOME:
+                stats.session = WELCOME_FORMAT.unpack(body)[0]
+                continue
+            if kind != MESSAGE_SNAPSHOT:
+                continue
+
+            _, ack, score, _, _, flags, _, _ = apply_snapshot(entities, body)
+            now = time.perf_counter()
+            stats.snapshots += 1
+            stats.score = score
+            for pending_sequence in [pending_sequence for pending_sequence in pending if pending_sequence <= ack]:
+                stats.latencies.append(now - pending.pop(pending_sequence))
+            if flags & SNAPSHOT_GAME_OVER:
+                stats.game_over = True
+                break
+
+            if stats.snapshots % HOLD_SNAPSHOTS == 0:
+                direction = rng.choice((0, INPUT_LEFT, INPUT_RIGHT))
+            new_inputs = direction | INPUT_JUMP if rng.random() < JUMP_CHANCE else direction
+            if new_inputs != inputs:
+                inputs = new_inputs
+                sequence += 1
+                pending[sequence] = now
+                writer.write(INPUT_FORMAT.pack(sequence, inputs))
+    except asyncio.IncompleteReadError:
+        pass
+    finally:
+        stats.seconds = time.perf_counter() - start
+        stats.entities = len(entities)
+        writer.close()
+    return stats
+
+async def run_load(connect, sessions, seconds, seed):
+    return await asyncio.gather(*(run_client(connect, seconds, seed + i) for i in range(sessions)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a platformer server with simulated clients")
+    parser.add_argument("--host", default="127.0.0.1", help="server address (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=7777, help="server TCP port (default: %(default)s)")
+    parser.add_argument("--unix", metavar="PATH", help="connect to a Unix socket instead of TCP")
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent sessions (default: %(default)s)")
+    parser.add_argument("--seconds", type=float, default=10.0,
+                        help="how long every session plays (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random inputs (default: %(default)s)")
+    parser.add_argument("--verbose", action="store_true", help="print a line for every session")
+    args = parser.parse_args()
+
+    if args.unix:
+        connect = lambda: asyncio.open_unix_connection(args.unix)
+    else:
+        connect = lambda: asyncio.open_connection(args.host, args.port)
+    results = asyncio.run(run_load(connect, args.sessions, args.seconds, args.seed))
+
+    for stats in results:
+        if args.verbose:
+            print(f"Session {stats.session}: {stats.snapshots / stats.seconds:.1f} snapshots/s, "
+                  f"{stats.bytes_received / stats.seconds / 1024:.1f} KB/s, input latency "
+                  f"{stats.latency_ms(50):.1f} ms median, {stats.latency_ms(99):.1f} ms p99, "
+                  f"{stats.entities} entities, score {stats.score}{', game over' if stats.game_over else ''}")
+
+    latencies = sorted(latency for stats in results for latency in stats.latencies)
+    seconds = max(stats.seconds for stats in results)
+    snapshots = sum(stats.snapshots for stats in results)
+    received = sum(stats.bytes_received for stats in results)
+    rates = sorted(stats.snapshots / stats.seconds for stats in results)
+    print(f"{len(results)} sessions for {seconds:.1f}s: {snapshots / seconds:.0f} snapshots/s "
+          f"(slowest session {rates[0]:.1f}/s), {received / seconds / 1024:.1f} KB/s "
+          f"({received / max(snapshots, 1):.0f} bytes per snapshot), "
+          f"{sum(stats.game_over for stats in results)} game overs")
+    if latencies:
+        print(f"Input latency: {percentile(latencies, 50):.1f} ms median, "
+              f"{percentile(latencies, 99):.1f} ms p99, "
+              f"{latencies[-1] * 1000:.1f} ms max")
+
+if __name__ == "__main__":
+    main()
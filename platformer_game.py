@@ -3,15 +3,41 @@ import sys
 import random
 import math
 import os
+import argparse
+import time
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict
+from replay import InputRecorder, InputReplay
+from profiler import FrameProfiler
+from capture import FrameCapture, CAPTURE_BUFFERS
+from level_format import LevelFile, level_path
+from reachability import JumpEnvelope, reachable
 
-# Initialize Pygame
-pygame.init()
+# NumPy is optional, it is only needed for the vectorised entity simulation
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 FPS = 60
+# Simulation ticks per second. The movement constants below are tuned per tick
+# at BASE_TICK_RATE and get scaled when the simulation runs at another rate.
+BASE_TICK_RATE = 60
+TICK_RATE = 60
+# Longest frame time fed into the simulation, so a stall doesn't snowball
+MAX_FRAME_TIME = 0.25
+# Frame rate while a menu screen shows and nothing on it changes
+IDLE_FPS = 15
 GRAVITY = 0.8
+# Fastest fall in pixels per base tick
+TERMINAL_VELOCITY = 20
 JUMP_STRENGTH = -16
 PLAYER_SPEED = 5
 
@@ -27,22 +53,107 @@ BROWN = (139, 69, 19)
 GOLD = (255, 215, 0)
 TRANSPARENT = (0, 0, 0, 0)
 
+# Maximum number of rendered text surfaces kept in the text cache
+TEXT_CACHE_SIZE = 128
+
+# Transparent colour of colour-keyed surfaces (sprites, background strips,
+# baked platform layers)
+COLOR_KEY = (255, 0, 255)
+
+# Cell size in pixels of the spatial grids used for collision broadphase
+GRID_CELL_SIZE = 64
+
+# Levels are split into chunks of this width. Chunks in view are drawn, chunks
+# within ACTIVE_CHUNK_MARGIN of the view are simulated and chunks within
+# LOADED_CHUNK_MARGIN have their sprites built; the rest only exist as data.
+CHUNK_WIDTH = 400
+ACTIVE_CHUNK_MARGIN = 1
+LOADED_CHUNK_MARGIN = 2
+
+# Released sprites kept for reuse, per sprite class
+POOL_MAX_FREE = 4096
+
+# Candidate layouts tried for a generated level before its unreachable coins
+# are moved instead, and validated levels kept per (level, seed, width)
+MAX_LEVEL_ATTEMPTS = 32
+LEVEL_CACHE_SIZE = 16
+
+# Input bits sampled once per simulation tick
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+
 # Game states
 MENU = 0
 PLAYING = 1
 GAME_OVER = 2
 CONTROLS = 3
 
-# Create the game window
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Enhanced 2D Platformer")
-clock = pygame.time.Clock()
+# Sprite images live next to this file, wherever the game is started from
+SPRITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sprites', 'sprites')
+
+# Packed sprite sheet written by sprites/generate_sprites.py. When present all
+# sprites come out of it with a single decode.
+ATLAS_IMAGE_FILE = 'atlas.png'
+ATLAS_INDEX_FILE = 'atlas.json'
+
+# Individual sprite image files by name, used when there is no atlas
+SPRITE_FILES = {
+    'player': 'player.png',
+    'platform': 'platform.png',
+    'coin': 'coin.png',
+    'enemy': 'enemy.png',
+}
+
+# Platform layouts (x, y, width, height) of the hand-made levels. Later levels
+# are generated by generate_level_data().
+LEVEL_PLATFORMS = {
+    1: [
+        (100, 400, 200, 20),
+        (400, 300, 150, 20),
+        (250, 200, 100, 20),
+        (550, 450, 200, 20),
+        (650, 200, 150, 20)
+    ],
+    2: [
+        (50, 450, 150, 20),
+        (300, 400, 100, 20),
+        (500, 350, 100, 20),
+        (650, 250, 150, 20),
+        (400, 200, 100, 20),
+        (200, 150, 100, 20),
+        (50, 250, 100, 20)
+    ],
+}
+
+# Set up by init_game(). Everything is drawn to screen at the game's own
+# SCREEN_WIDTH x SCREEN_HEIGHT resolution; when the window has another size
+# screen is an offscreen surface that present() scales into the window.
+screen = None
+clock = None
+start_time = None
+window = None
+# Part of the window the game is scaled into, None when screen is the window
+present_rect = None
+present_target = None
+smooth_present = False
+
+# How the game is fitted to a window of another size: 'scaled' lets SDL scale
+# while presenting (pygame.SCALED), 'fast' and 'smooth' scale the offscreen
+# surface with transform.scale or transform.smoothscale
+SCALE_MODES = ('none', 'scaled', 'fast', 'smooth')
+
+# Milliseconds spent in each startup phase
+startup_times = {'init': 0.0, 'display': 0.0, 'assets': 0.0}
 
 # Load sprites
-def load_sprite(filename, scale=1):
+def load_sprite(filename, scale=1, convert=True):
     try:
-        sprite_path = os.path.join('sprites', 'sprites', filename)
-        image = pygame.image.load(sprite_path).convert_alpha()
+        sprite_path = os.path.join(SPRITE_DIR, filename)
+        image = pygame.image.load(sprite_path)
+        # Converting needs a display, headless runs keep the loaded format
+        if convert:
+            image = prepare_image(image)
         if scale != 1:
             new_width = int(image.get_width() * scale)
             new_height = int(image.get_height() * scale)
@@ -55,19 +166,436 @@ def load_sprite(filename, scale=1):
         surface.fill(RED)
         return surface
 
-# Load sprites
-player_sprite = load_sprite('player.png')
-platform_sprite = load_sprite('platform.png')
-coin_sprite = load_sprite('coin.png')
-enemy_sprite = load_sprite('enemy.png')
+# Convert an image to the cheapest format to blit: fully opaque images lose
+# their alpha channel, images with only fully transparent and fully opaque
+# pixels get an RLE colour key, and only real translucency keeps per-pixel
+# alpha. Needs the display.
+def prepare_image(image):
+    width, height = image.get_size()
+    opaque = pygame.mask.from_surface(image, 254).count()
+    if opaque == width * height:
+        return image.convert()
+    if opaque == pygame.mask.from_surface(image, 0).count() and \
+            pygame.mask.from_threshold(image, COLOR_KEY, (1, 1, 1, 255)).count() == 0:
+        keyed = pygame.Surface((width, height)).convert()
+        keyed.fill(COLOR_KEY)
+        keyed.blit(image, (0, 0))
+        keyed.set_colorkey(COLOR_KEY, pygame.RLEACCEL)
+        return keyed
+    return image.convert_alpha()
+
+# Atlas image and its named sub-rectangles, loaded on first use
+atlas_image = None
+atlas_rects = None
+
+def load_atlas():
+    global atlas_image, atlas_rects
+    if atlas_rects is not None:
+        return atlas_image
+    
+    atlas_rects = {}
+    try:
+        with open(os.path.join(SPRITE_DIR, ATLAS_INDEX_FILE)) as f:
+            index = json.load(f)
+        image = pygame.image.load(os.path.join(SPRITE_DIR, ATLAS_IMAGE_FILE))
+    except (OSError, ValueError, pygame.error):
+        # No usable atlas, sprites are loaded from their own files
+        return None
+    
+    if screen is not None:
+        image = image.convert_alpha()
+    atlas_image = image
+    atlas_rects = {name: pygame.Rect(rect) for name, rect in index['sprites'].items()}
+    return atlas_image
+
+# Decoded sprite images by name
+sprite_images = {}
+
+def get_sprite(name):
+    image = sprite_images.get(name)
+    if image is None:
+        start = time.perf_counter()
+        load_atlas()
+        if name in atlas_rects:
+            image = atlas_image.subsurface(atlas_rects[name])
+            if screen is not None:
+                image = prepare_image(image)
+        else:
+            image = load_sprite(SPRITE_FILES[name], convert=screen is not None)
+        sprite_images[name] = image
+        startup_times['assets'] += (time.perf_counter() - start) * 1000
+    return image
+
+# Initialize the pygame subsystems the game uses and create the game window.
+# Safe to call more than once; only the first call does any work.
+def init_game(scale_mode='none', window_size=None, fullscreen=False):
+    global screen, clock, start_time, atlas_image, window, present_rect, present_target, smooth_present
+    if screen is not None:
+        return screen
+    
+    # Audio and joysticks are never used, so only video and fonts are started
+    start = time.perf_counter()
+    pygame.display.init()
+    pygame.font.init()
+    startup_times['init'] += (time.perf_counter() - start) * 1000
+    
+    start = time.perf_counter()
+    flags = pygame.FULLSCREEN if fullscreen else 0
+    if scale_mode in ('fast', 'smooth'):
+        if window_size is None:
+            window_size = pygame.display.get_desktop_sizes()[0]
+        window = pygame.display.set_mode(window_size, flags)
+        screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+        # Largest size with the game's aspect ratio, centred with black bars
+        scale = min(window_size[0] / SCREEN_WIDTH, window_size[1] / SCREEN_HEIGHT)
+        present_rect = pygame.Rect(0, 0, round(SCREEN_WIDTH * scale), round(SCREEN_HEIGHT * scale))
+        present_rect.center = window.get_rect().center
+        present_target = window.subsurface(present_rect)
+        smooth_present = scale_mode == 'smooth'
+        window.fill(BLACK)
+        pygame.display.flip()
+    else:
+        if scale_mode == 'scaled':
+            flags |= pygame.SCALED
+        window = screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), flags)
+    pygame.display.set_caption("Enhanced 2D Platformer")
+    clock = pygame.time.Clock()
+    start_time = start
+    startup_times['display'] += (time.perf_counter() - start) * 1000
+    
+    # Sprites decoded before the window existed are converted for fast blitting
+    if atlas_image is not None:
+        atlas_image = atlas_image.convert_alpha()
+    for name, image in sprite_images.items():
+        if atlas_image is not None and name in atlas_rects:
+            image = atlas_image.subsurface(atlas_rects[name])
+        sprite_images[name] = prepare_image(image)
+    # Pooled sprites still point at the unconverted images
+    sprite_pool.clear()
+    background_cache.clear()
+    return screen
+
+def get_screen():
+    return init_game()
+
+# Show the frame drawn to screen, scaling it into the window in one pass if
+# the window has another size. dirty limits the update to those rects when
+# no scaling is needed.
+def present(dirty=None):
+    if present_rect is None:
+        if dirty is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+        return
+    if smooth_present:
+        pygame.transform.smoothscale(screen, present_rect.size, present_target)
+    else:
+        pygame.transform.scale(screen, present_rect.size, present_target)
+    pygame.display.update(present_rect)
+
+# Window coordinates (e.g. of the mouse) to game coordinates
+def window_to_screen(pos):
+    if present_rect is None:
+        return pos
+    return ((pos[0] - present_rect.x) * SCREEN_WIDTH // present_rect.width,
+            (pos[1] - present_rect.y) * SCREEN_HEIGHT // present_rect.height)
+
+# Milliseconds since the window was created, drives background animation
+def game_ticks():
+    if start_time is None:
+        return 0
+    return int((time.perf_counter() - start_time) * 1000)
+
+def startup_report():
+    total = sum(startup_times.values())
+    phases = ", ".join(f"{phase} {ms:.1f} ms" for phase, ms in startup_times.items())
+    return f"Startup: {phases}, total {total:.1f} ms"
+
+# Fonts are expensive to construct, so keep one per size
+fonts = {}
+
+def get_font(size):
+    font = fonts.get(size)
+    if font is None:
+        font = pygame.font.Font(None, size)
+        fonts[size] = font
+    return font
+
+# Bounded LRU cache of rendered text surfaces keyed by (text, size, color)
+class TextCache:
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def render(self, text, size, color):
+        key = (text, size, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        
+        self.misses += 1
+        surface = get_font(size).render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+    
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+text_cache = TextCache()
+
+# Uniform grid that maps cells to the sprites overlapping them
+class SpatialGrid:
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.bounds = {}
+        # Insertion order, so query results match the order of a group scan
+        self.order = {}
+        self.next_order = 0
+    
+    def cell_bounds(self, rect):
+        size = self.cell_size
+        return (rect.left // size, rect.top // size,
+                (rect.right - 1) // size, (rect.bottom - 1) // size)
+    
+    def add_to_cells(self, sprite, bounds):
+        left, top, right, bottom = bounds
+        for cx in range(left, right + 1):
+            for cy in range(top, bottom + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is None:
+                    cell = self.cells[(cx, cy)] = {}
+                cell[sprite] = None
+    
+    def remove_from_cells(self, sprite, bounds):
+        left, top, right, bottom = bounds
+        for cx in range(left, right + 1):
+            for cy in range(top, bottom + 1):
+                cell = self.cells[(cx, cy)]
+                del cell[sprite]
+                if not cell:
+                    del self.cells[(cx, cy)]
+    
+    def insert(self, sprite):
+        bounds = self.cell_bounds(sprite.rect)
+        self.bounds[sprite] = bounds
+        self.order[sprite] = self.next_order
+        self.next_order += 1
+        self.add_to_cells(sprite, bounds)
+    
+    def remove(self, sprite):
+        bounds = self.bounds.pop(sprite, None)
+        if bounds is not None:
+            del self.order[sprite]
+            self.remove_from_cells(sprite, bounds)
+    
+    def move(self, sprite):
+        # Sprites removed in the meantime stay out of the grid
+        old_bounds = self.bounds.get(sprite)
+        if old_bounds is None:
+            return
+        # Only touch the cells when the sprite crossed a cell boundary
+        bounds = self.cell_bounds(sprite.rect)
+        if bounds != old_bounds:
+            self.remove_from_cells(sprite, old_bounds)
+            self.add_to_cells(sprite, bounds)
+            self.bounds[sprite] = bounds
+    
+    def query(self, rect):
+        left, top, right, bottom = self.cell_bounds(rect)
+        found = {}
+        for cx in range(left, right + 1):
+            for cy in range(top, bottom + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found.update(cell)
+        if len(found) > 1:
+            return sorted(found, key=self.order.__getitem__)
+        return list(found)
+    
+    def collide(self, rect):
+        return [sprite for sprite in self.query(rect) if rect.colliderect(sprite.rect)]
+    
+    def clear(self):
+        self.cells.clear()
+        self.bounds.clear()
+        self.order.clear()
+
+# Sprite group that keeps its members indexed in a spatial grid
+class SpatialGroup(pygame.sprite.Group):
+    def __init__(self, *sprites, cell_size=GRID_CELL_SIZE):
+        self.grid = SpatialGrid(cell_size)
+        super().__init__(*sprites)
+    
+    def add_internal(self, sprite, *args):
+        super().add_internal(sprite, *args)
+        self.grid.insert(sprite)
+    
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.grid.remove(sprite)
+    
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        # Re-index members that moved during the update
+        for sprite in self.sprites():
+            self.grid.move(sprite)
+    
+    # Update and re-index only some of the members
+    def update_members(self, sprites, *args, **kwargs):
+        move = self.grid.move
+        for sprite in sprites:
+            sprite.update(*args, **kwargs)
+            move(sprite)
+    
+    def collide(self, sprite, dokill=False):
+        hits = self.grid.collide(sprite.rect)
+        if dokill:
+            for hit in hits:
+                hit.kill()
+        return hits
+
+# Like pygame.sprite.spritecollide, but uses the group's spatial grid if it has one
+def collide_group(sprite, group, dokill=False):
+    if isinstance(group, SpatialGroup):
+        return group.collide(sprite, dokill)
+    return pygame.sprite.spritecollide(sprite, group, dokill)
+
+# Move rect by (dx, dy) pixels, one of them zero, against the sprites of group
+# and return how far it gets and the sprite it stops at (or None). Everything
+# the move sweeps over is checked, so nothing is skipped however fast the
+# move. Sprites the rect already overlaps don't block it.
+def sweep(rect, dx, dy, group):
+    swept = rect.union(rect.move(dx, dy))
+    if isinstance(group, SpatialGroup):
+        candidates = group.grid.query(swept)
+    else:
+        candidates = group.sprites()
+    
+    hit = None
+    for sprite in candidates:
+        other = sprite.rect
+        if dx:
+            if rect.top >= other.bottom or rect.bottom <= other.top:
+                continue
+            if dx > 0 and rect.right <= other.left < rect.right + dx:
+                dx = other.left - rect.right
+                hit = sprite
+            elif dx < 0 and rect.left + dx < other.right <= rect.left:
+                dx = other.right - rect.left
+                hit = sprite
+        else:
+            if rect.left >= other.right or rect.right <= other.left:
+                continue
+            if dy > 0 and rect.bottom <= other.top < rect.bottom + dy:
+                dy = other.top - rect.bottom
+                hit = sprite
+            elif dy < 0 and rect.top + dy < other.bottom <= rect.top:
+                dy = other.bottom - rect.top
+                hit = sprite
+    return dx, dy, hit
+
+# Shared cache of flipped and scaled sprite variants keyed by (source, flip, size)
+class SpriteVariantCache:
+    def __init__(self):
+        self.variants = {}
+        self.hits = 0
+        self.misses = 0
+        # Levels are also built on the prefetch thread
+        self.lock = threading.Lock()
+    
+    def get(self, source, flip=False, size=None):
+        key = (source, flip, size)
+        with self.lock:
+            image = self.variants.get(key)
+            if image is not None:
+                self.hits += 1
+                return image
+            
+            self.misses += 1
+            image = source
+            if size is not None and size != source.get_size():
+                image = pygame.transform.scale(image, size)
+            if flip:
+                image = pygame.transform.flip(image, True, False)
+            self.variants[key] = image
+            return image
+    
+    def clear(self):
+        with self.lock:
+            self.variants.clear()
+            self.hits = 0
+            self.misses = 0
+
+sprite_variants = SpriteVariantCache()
+
+# Recycles sprites between chunk loads, levels and sessions. acquire() hands
+# out a released instance of the class, reinitialised through its reset(),
+# and only creates a new one when none is free. Levels are built on the
+# prefetch thread too, so the free lists are locked.
+class SpritePool:
+    def __init__(self, max_free=POOL_MAX_FREE):
+        self.max_free = max_free
+        self.free = {}
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+    
+    def acquire(self, cls, *args):
+        with self.lock:
+            free = self.free.get(cls)
+            sprite = free.pop() if free else None
+            if sprite is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if sprite is None:
+            return cls(*args)
+        sprite.reset(*args)
+        return sprite
+    
+    # Take a sprite out of all its groups and keep it for reuse. The caller
+    # must not hold on to it.
+    def release(self, sprite):
+        sprite.kill()
+        with self.lock:
+            free = self.free.setdefault(type(sprite), [])
+            self.released += 1
+            if len(free) < self.max_free:
+                free.append(sprite)
+    
+    def stats(self):
+        with self.lock:
+            return {'created': self.created, 'reused': self.reused, 'released': self.released,
+                    'free': sum(len(free) for free in self.free.values())}
+    
+    def clear(self):
+        with self.lock:
+            self.free.clear()
+
+sprite_pool = SpritePool()
 
 # Platform class
 class Platform(pygame.sprite.Sprite):
     def __init__(self, x, y, width, height):
         super().__init__()
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.reset(x, y, width, height)
+    
+    def reset(self, x, y, width, height):
         # Scale the platform sprite to the desired width and height
-        self.image = pygame.transform.scale(platform_sprite, (width, height))
-        self.rect = self.image.get_rect()
+        self.image = sprite_variants.get(get_sprite('platform'), size=(width, height))
+        self.rect.size = self.image.get_size()
         self.rect.x = x
         self.rect.y = y
 
@@ -75,41 +603,53 @@ class Platform(pygame.sprite.Sprite):
 class Coin(pygame.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = coin_sprite
+        self.image = get_sprite('coin')
         self.rect = self.image.get_rect()
+        self.reset(x, y)
+    
+    def reset(self, x, y):
         self.rect.center = (x, y)
+        self.prev_pos = self.rect.topleft
         # Animation variables
         self.animation_timer = 0
         self.original_y = y
         
-    def update(self):
+    def update(self, dt=1.0):
+        self.prev_pos = self.rect.topleft
         # Make coin bob up and down slightly
-        self.animation_timer += 0.1
+        self.animation_timer += 0.1 * dt
         self.rect.y = self.original_y + int(3 * math.sin(self.animation_timer))
 
 # Enemy class
 class Enemy(pygame.sprite.Sprite):
     def __init__(self, x, y, min_x, max_x):
         super().__init__()
-        self.image = enemy_sprite
-        self.rect = self.image.get_rect()
+        self.original_image = get_sprite('enemy')
+        self.rect = self.original_image.get_rect()
+        self.reset(x, y, min_x, max_x)
+    
+    def reset(self, x, y, min_x, max_x):
+        self.image = self.original_image
         self.rect.x = x
         self.rect.y = y
+        self.x = float(x)
+        self.prev_pos = self.rect.topleft
         self.min_x = min_x
         self.max_x = max_x
         self.velocity = 2
         self.facing_right = True
-        self.original_image = self.image
     
-    def update(self):
-        self.rect.x += self.velocity
+    def update(self, dt=1.0):
+        self.prev_pos = self.rect.topleft
+        self.x += self.velocity * dt
+        self.rect.x = round(self.x)
         
         # Flip the sprite based on direction
         if self.velocity > 0 and not self.facing_right:
-            self.image = pygame.transform.flip(self.original_image, True, False)
+            self.image = sprite_variants.get(self.original_image)
             self.facing_right = True
         elif self.velocity < 0 and self.facing_right:
-            self.image = pygame.transform.flip(self.original_image, True, False)
+            self.image = sprite_variants.get(self.original_image, flip=True)
             self.facing_right = False
         
         if self.rect.left <= self.min_x or self.rect.right >= self.max_x:
@@ -119,60 +659,96 @@ class Enemy(pygame.sprite.Sprite):
 class Player(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = player_sprite
-        self.rect = self.image.get_rect()
+        self.original_image = get_sprite('player')
+        self.rect = self.original_image.get_rect()
+        self.reset()
+    
+    def reset(self):
+        self.image = self.original_image
+        self.respawn()
+        self.facing_right = True
+        self.on_ground = False
+    
+    def respawn(self):
         self.rect.center = (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 2)
+        # Sub-pixel position, the rect holds the rounded value
+        self.x = float(self.rect.x)
+        self.y = float(self.rect.y)
+        self.prev_pos = self.rect.topleft
         
         # Movement variables
         self.velocity_x = 0
         self.velocity_y = 0
-        self.on_ground = False
-        self.facing_right = True
-        self.original_image = self.image
     
-    def update(self, platforms):
+    def update(self, platforms, dt=1.0, world_width=SCREEN_WIDTH):
+        self.prev_pos = self.rect.topleft
+        
         # Apply gravity
-        self.velocity_y += GRAVITY
+        self.velocity_y = min(self.velocity_y + GRAVITY * dt, TERMINAL_VELOCITY)
         
-        # Move horizontally
-        self.rect.x += self.velocity_x
+        # Move horizontally, stopping at the first platform in the way
+        self.x += self.velocity_x * dt
+        dx, _, hit = sweep(self.rect, round(self.x) - self.rect.x, 0, platforms)
+        self.rect.x += dx
+        if hit:
+            self.x = float(self.rect.x)
+        # sweep() lets the player out of platforms it started inside (e.g. one
+        # across the spawn point), those are resolved as before
+        for platform in collide_group(self, platforms):
+            if self.velocity_x > 0:  # Moving right
+                self.rect.right = platform.rect.left
+            elif self.velocity_x < 0:  # Moving left
+                self.rect.left = platform.rect.right
+            self.x = float(self.rect.x)
         
         # Update sprite direction
         if self.velocity_x > 0 and not self.facing_right:
-            self.image = pygame.transform.flip(self.original_image, True, False)
+            self.image = sprite_variants.get(self.original_image)
             self.facing_right = True
         elif self.velocity_x < 0 and self.facing_right:
-            self.image = pygame.transform.flip(self.original_image, True, False)
+            self.image = sprite_variants.get(self.original_image, flip=True)
             self.facing_right = False
         
-        # Check for horizontal collisions
-        platform_hit_list = pygame.sprite.spritecollide(self, platforms, False)
-        for platform in platform_hit_list:
-            if self.velocity_x > 0:  # Moving right
-                self.rect.right = platform.rect.left
-            elif self.velocity_x < 0:  # Moving left
-                self.rect.left = platform.rect.right
-        
-        # Move vertically
-        self.rect.y += self.velocity_y
-        
-        # Check for vertical collisions
+        # Move vertically, landing on or bumping into the first platform
+        velocity_y = self.velocity_y
+        self.y += velocity_y * dt
+        _, dy, hit = sweep(self.rect, 0, round(self.y) - self.rect.y, platforms)
+        self.rect.y += dy
         self.on_ground = False
-        platform_hit_list = pygame.sprite.spritecollide(self, platforms, False)
-        for platform in platform_hit_list:
+        if hit:
             if self.velocity_y > 0:  # Falling
+                self.on_ground = True
+            self.velocity_y = 0
+            self.y = float(self.rect.y)
+        for platform in collide_group(self, platforms):
+            if velocity_y > 0:  # Falling
                 self.rect.bottom = platform.rect.top
                 self.velocity_y = 0
                 self.on_ground = True
-            elif self.velocity_y < 0:  # Jumping
+            elif velocity_y < 0:  # Jumping
                 self.rect.top = platform.rect.bottom
                 self.velocity_y = 0
+            self.y = float(self.rect.y)
+        
+        # At high tick rates a resting player moves less than a pixel per tick,
+        # so check for ground right below instead of waiting for an overlap
+        if not self.on_ground and self.velocity_y >= 0:
+            self.rect.y += 1
+            for platform in collide_group(self, platforms):
+                if platform.rect.top == self.rect.bottom - 1:
+                    self.on_ground = True
+            self.rect.y -= 1
+            if self.on_ground:
+                self.velocity_y = 0
+                self.y = float(self.rect.y)
         
-        # Keep player on screen horizontally
+        # Keep player inside the level horizontally
         if self.rect.left < 0:
             self.rect.left = 0
-        if self.rect.right > SCREEN_WIDTH:
-            self.rect.right = SCREEN_WIDTH
+            self.x = float(self.rect.x)
+        if self.rect.right > world_width:
+            self.rect.right = world_width
+            self.x = float(self.rect.x)
     
     def jump(self):
         if self.on_ground:
@@ -203,8 +779,7 @@ class Button:
         pygame.draw.rect(surface, color, self.rect)
         pygame.draw.rect(surface, BLACK, self.rect, 2)  # Border
         
-        font = pygame.font.Font(None, 36)
-        text_surface = font.render(self.text, True, BLACK)
+        text_surface = text_cache.render(self.text, 36, BLACK)
         text_rect = text_surface.get_rect(center=self.rect.center)
         surface.blit(text_surface, text_rect)
     
@@ -218,119 +793,1208 @@ class Button:
                 return self.action()
         return None
 
-# Create platforms, coins and enemies for the level
-def create_level(level=1):
-    platforms = pygame.sprite.Group()
-    coins = pygame.sprite.Group()
-    enemies = pygame.sprite.Group()
+# The entities of a level as plain specs, indexed by the chunks they touch:
+# platforms are (x, y, width, height), coins (center x, center y) and enemies
+# (x, y, min_x, max_x). Chunk contents come out of load_chunk() as
+# (id, spec) pairs, ids are unique per level and entity type.
+class LevelData:
+    def __init__(self, width, platforms, coins, enemies, chunk_width=CHUNK_WIDTH):
+        self.width = width
+        self.chunk_width = chunk_width
+        self.platforms = platforms
+        self.coins = coins
+        self.enemies = enemies
+        self.coin_count = len(coins)
+        self.chunk_count = max(1, -(-width // chunk_width))
+        
+        self.chunk_index = [([], [], []) for _ in range(self.chunk_count)]
+        for i, (x, y, w, h) in enumerate(platforms):
+            # Platforms wider than a chunk are listed in every chunk they cross
+            for chunk in range(self.chunk_of(x), self.chunk_of(x + w - 1) + 1):
+                self.chunk_index[chunk][0].append(i)
+        for i, (x, y) in enumerate(coins):
+            self.chunk_index[self.chunk_of(x)][1].append(i)
+        for i, (x, y, min_x, max_x) in enumerate(enemies):
+            self.chunk_index[self.chunk_of((min_x + max_x) // 2)][2].append(i)
+    
+    def chunk_of(self, x):
+        return min(max(int(x) // self.chunk_width, 0), self.chunk_count - 1)
+    
+    def load_chunk(self, index):
+        platform_ids, coin_ids, enemy_ids = self.chunk_index[index]
+        return ([(i, self.platforms[i]) for i in platform_ids],
+                [(i, self.coins[i]) for i in coin_ids],
+                [(i, self.enemies[i]) for i in enemy_ids])
+    
+    def close(self):
+        pass
+
+# Lay out platforms, coins and enemies for the level. Hand-made levels are one
+# screen wide, generated ones (level 3 and beyond) fill the given width.
+def generate_level_data(level=1, rng=random, width=SCREEN_WIDTH):
+    if level in LEVEL_PLATFORMS:
+        width = SCREEN_WIDTH
+    width = max(width, SCREEN_WIDTH)
     
-    # Ground platform
-    ground = Platform(0, SCREEN_HEIGHT - 50, SCREEN_WIDTH, 50)
-    platforms.add(ground)
+    # Ground platform, one screen wide piece after piece
+    platform_data = [(x, SCREEN_HEIGHT - 50, min(SCREEN_WIDTH, width - x), 50)
+                     for x in range(0, width, SCREEN_WIDTH)]
+    ground_count = len(platform_data)
+    coin_data = []
+    enemy_data = []
     
     # Add platforms based on level
-    if level == 1:
-        platform_data = [
-            (100, 400, 200, 20),
-            (400, 300, 150, 20),
-            (250, 200, 100, 20),
-            (550, 450, 200, 20),
-            (650, 200, 150, 20)
-        ]
-    elif level == 2:
-        platform_data = [
-            (50, 450, 150, 20),
-            (300, 400, 100, 20),
-            (500, 350, 100, 20),
-            (650, 250, 150, 20),
-            (400, 200, 100, 20),
-            (200, 150, 100, 20),
-            (50, 250, 100, 20)
-        ]
+    if level in LEVEL_PLATFORMS:
+        platform_data.extend(LEVEL_PLATFORMS[level])
     else:  # Level 3 and beyond
-        platform_data = []
-        for i in range(8):
-            x = random.randint(50, SCREEN_WIDTH - 150)
-            y = 150 + i * 60
-            width = random.randint(80, 200)
-            platform_data.append((x, y, width, 20))
+        for screen_x in range(0, width, SCREEN_WIDTH):
+            # The last screen can be cut short by the level's end, a piece too
+            # narrow for a platform only has ground
+            span = min(SCREEN_WIDTH, width - screen_x)
+            if span < 80:
+                continue
+            low = min(50, span - 80)
+            for i in range(8):
+                x = screen_x + rng.randint(low, max(low, span - 150))
+                y = 150 + i * 60
+                platform_width = rng.randint(80, 200)
+                platform_data.append((x, y, platform_width, 20))
     
-    for x, y, width, height in platform_data:
-        platforms.add(Platform(x, y, width, height))
-        
+    for x, y, platform_width, height in platform_data[ground_count:]:
         # Add coins on platforms
-        if random.random() > 0.3:  # 70% chance to spawn a coin
-            coins.add(Coin(x + width // 2, y - 25))
+        if rng.random() > 0.3:  # 70% chance to spawn a coin
+            coin_data.append((x + platform_width // 2, y - 25))
         
         # Add enemies on some platforms (more enemies in higher levels)
-        if width > 100 and random.random() > (0.6 - level * 0.1):
-            enemies.add(Enemy(x + width // 2, y - 30, x, x + width))
+        if platform_width > 100 and rng.random() > (0.6 - level * 0.1):
+            enemy_data.append((x + platform_width // 2, y - 30, x, x + platform_width))
     
     # Ensure there's at least 3 coins per level
-    if len(coins) < 3:
-        for _ in range(3 - len(coins)):
-            platform = random.choice(list(platforms)[1:])  # Skip ground platform
-            coins.add(Coin(platform.rect.centerx, platform.rect.top - 25))
-    
-    return platforms, coins, enemies
-
-# Draw text on screen
-def draw_text(text, size, color, x, y):
-    font = pygame.font.Font(None, size)
-    text_surface = font.render(text, True, color)
-    text_rect = text_surface.get_rect()
-    text_rect.midtop = (x, y)
-    screen.blit(text_surface, text_rect)
-
-# Draw background with parallax effect
-def draw_background(level):
+    if len(coin_data) < 3:
+        for _ in range(3 - len(coin_data)):
+            x, y, platform_width, height = rng.choice(platform_data[ground_count:])  # Skip ground
+            coin_data.append((x + platform_width // 2, y - 25))
+    
+    return LevelData(width, platform_data, coin_data, enemy_data)
+
+# Left edge of the screen-sized view centred on x, kept inside the level
+def view_left(center_x, world_width):
+    return max(0, min(center_x - SCREEN_WIDTH // 2, world_width - SCREEN_WIDTH))
+
+# A level being played, streamed in chunks from a level source (LevelData, a
+# LevelFile or anything else with the same width/chunk_width/chunk_count/
+# coin_count/chunk_of()/load_chunk()/close() interface). The sprite groups only ever contain the
+# entities of loaded chunks.
+class ChunkedWorld:
+    def __init__(self, source):
+        self.source = source
+        self.width = source.width
+        self.platforms = SpatialGroup()
+        self.coins = SpatialGroup()
+        self.enemies = SpatialGroup()
+        # Coins and enemies of the simulated chunks
+        self.active_coins = []
+        self.active_enemies = []
+        
+        # chunk index -> (coin sprites, enemy sprites, platform ids)
+        self.chunks = {}
+        # chunk index -> baked platform layer, see chunk_layer()
+        self.layers = {}
+        # Platforms can be shared by several chunks: id -> [sprite, chunk count]
+        self.platform_refs = {}
+        self.coin_ids = {}
+        self.coin_chunks = {}
+        self.collected = set()
+        self.coins_remaining = source.coin_count
+        
+        self.visible = range(0)
+        self.active = range(0)
+        # Bumped whenever the visible and active chunks change
+        self.version = 0
+    
+    # True when the whole level fits in one view, nothing is ever streamed
+    def fits_view(self):
+        return self.width <= SCREEN_WIDTH
+    
+    def load_chunk(self, index):
+        platform_specs, coin_specs, enemy_specs = self.source.load_chunk(index)
+        platform_ids = []
+        for platform_id, spec in platform_specs:
+            ref = self.platform_refs.get(platform_id)
+            if ref is None:
+                platform = sprite_pool.acquire(Platform, *spec)
+                self.platforms.add(platform)
+                self.platform_refs[platform_id] = [platform, 1]
+            else:
+                ref[1] += 1
+            platform_ids.append(platform_id)
+        
+        coins = []
+        for coin_id, spec in coin_specs:
+            if coin_id not in self.collected:
+                coin = sprite_pool.acquire(Coin, *spec)
+                self.coin_ids[coin] = coin_id
+                self.coin_chunks[coin] = index
+                coins.append(coin)
+        self.coins.add(coins)
+        
+        # Enemies start over from their spawn point every time they are loaded
+        enemies = [sprite_pool.acquire(Enemy, *spec) for _, spec in enemy_specs]
+        self.enemies.add(enemies)
+        
+        self.chunks[index] = (coins, enemies, platform_ids)
+    
+    def unload_chunk(self, index):
+        coins, enemies, platform_ids = self.chunks.pop(index)
+        self.layers.pop(index, None)
+        for coin in coins:
+            sprite_pool.release(coin)
+            del self.coin_ids[coin]
+            del self.coin_chunks[coin]
+        for enemy in enemies:
+            sprite_pool.release(enemy)
+        for platform_id in platform_ids:
+            ref = self.platform_refs[platform_id]
+            ref[1] -= 1
+            if ref[1] == 0:
+                sprite_pool.release(ref[0])
+                del self.platform_refs[platform_id]
+    
+    # Load, activate and cull chunks for a view starting at left. Returns True
+    # when the view moved into other chunks.
+    def update_view(self, left):
+        if not self.view_changes(left):
+            return False
+        source = self.source
+        first = source.chunk_of(left)
+        last = source.chunk_of(left + SCREEN_WIDTH - 1)
+        self.visible = range(first, last + 1)
+        
+        loaded = range(max(0, first - LOADED_CHUNK_MARGIN),
+                       min(source.chunk_count, last + LOADED_CHUNK_MARGIN + 1))
+        for index in list(self.chunks):
+            if index not in loaded:
+                self.unload_chunk(index)
+        for index in loaded:
+            if index not in self.chunks:
+                self.load_chunk(index)
+        
+        self.active = range(max(0, first - ACTIVE_CHUNK_MARGIN),
+                            min(source.chunk_count, last + ACTIVE_CHUNK_MARGIN + 1))
+        self.active_coins = [coin for index in self.active for coin in self.chunks[index][0]]
+        self.active_enemies = [enemy for index in self.active for enemy in self.chunks[index][1]]
+        self.version += 1
+        return True
+    
+    # True when a view starting at left covers other chunks than the current one
+    def view_changes(self, left):
+        source = self.source
+        return self.visible != range(source.chunk_of(left), source.chunk_of(left + SCREEN_WIDTH - 1) + 1)
+    
+    # Remember a picked up coin so it doesn't come back when its chunk reloads
+    def collect(self, coin):
+        sprite_pool.release(coin)
+        self.collected.add(self.coin_ids.pop(coin))
+        index = self.coin_chunks.pop(coin)
+        self.chunks[index][0].remove(coin)
+        if index in self.active:
+            self.active_coins.remove(coin)
+        self.coins_remaining -= 1
+    
+    # Unload everything, handing the sprites back to the pool
+    def release(self):
+        for index in list(self.chunks):
+            self.unload_chunk(index)
+        self.active_coins = []
+        self.active_enemies = []
+        self.visible = range(0)
+        self.active = range(0)
+        self.source.close()
+    
+    # The platforms of a loaded chunk baked into one surface, as (surface, x, y)
+    # in level coordinates, or None for a chunk without platforms. Built the
+    # first time the chunk is drawn, so simulation-only runs never pay for it.
+    def chunk_layer(self, index):
+        if index in self.layers:
+            return self.layers[index]
+        
+        platforms = [self.platform_refs[platform_id][0] for platform_id in self.chunks[index][2]]
+        layer = None
+        if platforms:
+            left = index * self.source.chunk_width
+            bounds = platforms[0].rect.unionall([platform.rect for platform in platforms])
+            bounds = bounds.clip(pygame.Rect(left, bounds.y, min(self.source.chunk_width, self.width - left),
+                                             bounds.height))
+            # Opaque platform images go onto a colour-keyed layer, translucent ones
+            # need a layer with per-pixel alpha
+            if any(platform.image.get_flags() & pygame.SRCALPHA for platform in platforms):
+                surface = pygame.Surface(bounds.size, pygame.SRCALPHA)
+            else:
+                surface = pygame.Surface(bounds.size)
+                if pygame.display.get_surface() is not None:
+                    surface = surface.convert()
+                surface.fill(COLOR_KEY)
+                surface.set_colorkey(COLOR_KEY, pygame.RLEACCEL)
+            surface.blits([(platform.image, (platform.rect.x - bounds.x, platform.rect.y - bounds.y))
+                           for platform in platforms], False)
+            layer = (surface, bounds.x, bounds.y)
+        self.layers[index] = layer
+        return layer
+    
+    # Baked platform layers of the loaded chunks overlapping view_rect
+    def visible_layers(self, view_rect):
+        layers = []
+        for index in range(self.source.chunk_of(view_rect.left), self.source.chunk_of(view_rect.right - 1) + 1):
+            if index in self.chunks:
+                layer = self.chunk_layer(index)
+                if layer:
+                    layers.append(layer)
+        return layers
+    
+    # Coins and enemies overlapping view_rect, in drawing order. Platforms are
+    # drawn from the layers.
+    def visible_sprites(self, view_rect):
+        if self.fits_view():
+            return [*self.coins, *self.enemies]
+        return self.coins.grid.query(view_rect) + self.enemies.grid.query(view_rect)
+
+# Every level of a session gets its own RNG derived from the session seed, so
+# a level comes out the same no matter when or on which thread it is built
+def level_rng(seed, level):
+    return random.Random(f"{seed}:{level}")
+
+# RNG of one candidate layout of a generated level. The first candidate is
+# the level's usual RNG, so levels that were already valid stay the same.
+def candidate_rng(seed, level, attempt):
+    if attempt == 0:
+        return level_rng(seed, level)
+    return random.Random(f"{seed}:{level}:{attempt}")
+
+# Set up by get_jump_envelope()
+jump_envelope = None
+
+def get_jump_envelope():
+    global jump_envelope
+    if jump_envelope is None:
+        jump_envelope = JumpEnvelope(GRAVITY, JUMP_STRENGTH, PLAYER_SPEED, TERMINAL_VELOCITY,
+                                     get_sprite('player').get_size(), SCREEN_HEIGHT)
+    return jump_envelope
+
+# Indices of the platforms and coins of a level the player can get to, see
+# reachability.reachable(). The player starts on the platform it drops onto
+# from the spawn point.
+def level_reachability(data):
+    envelope = get_jump_envelope()
+    coin_width, coin_height = get_sprite('coin').get_size()
+    coins = [(x - coin_width // 2, y - coin_height // 2, coin_width, coin_height) for x, y in data.coins]
+    spawn = pygame.Rect(0, 0, envelope.player_width, envelope.player_height)
+    spawn.center = (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 2)
+    below = [i for i, (x, y, width, height) in enumerate(data.platforms)
+             if x < spawn.right and x + width > spawn.left and y >= spawn.bottom]
+    start = [min(below, key=lambda i: data.platforms[i][1])] if below else []
+    return reachable(envelope, data.platforms, coins, start)
+
+# Number of coins the player can't reach in one candidate layout. Runs on the
+# level generator's worker processes, so it only takes and returns plain values.
+def check_level_candidate(level, seed, width, attempt):
+    data = generate_level_data(level, candidate_rng(seed, level, attempt), width)
+    return len(data.coins) - len(level_reachability(data)[1])
+
+# First of the candidates first to first + count - 1 with every coin
+# reachable, or None. One job of the level generator's process pool.
+def check_level_candidates(level, seed, width, first, count):
+    for attempt in range(first, first + count):
+        if check_level_candidate(level, seed, width, attempt) == 0:
+            return attempt
+    return None
+
+# Keep the reachable coins of a level and put new ones above reachable
+# platforms until it has three again
+def drop_unreachable_coins(data, rng):
+    platforms, coins = level_reachability(data)
+    coin_data = [coin for i, coin in enumerate(data.coins) if i in coins]
+    platforms = sorted(platforms)
+    while len(coin_data) < 3 and platforms:
+        x, y, platform_width, height = data.platforms[rng.choice(platforms)]
+        coin_data.append((x + platform_width // 2, y - 25))
+    return LevelData(data.width, data.platforms, coin_data, data.enemies)
+
+# Produces the layouts of generated levels (level 3 and beyond) that every
+# coin can be reached in. Candidates are made from candidate_rng() one after
+# the other until one passes the reachability check; with processes > 1 all
+# of them are split into one run of candidates per process. The first passing
+# candidate wins either way, so a seed always gives the same level. Validated
+# levels are cached by (level, seed, width).
+# A candidate only takes about 0.1 ms per screen of level, so the pool only
+# pays off for very wide levels on a machine with cores to spare.
+class LevelGenerator:
+    def __init__(self, processes=1, cache_size=LEVEL_CACHE_SIZE):
+        self.processes = 1
+        self.executor = None
+        self.cache_size = cache_size
+        self.levels = OrderedDict()
+        self.lock = threading.Lock()
+        self.generated = 0
+        self.rejected = 0
+        self.repaired = 0
+        self.hits = 0
+        self.set_processes(processes)
+    
+    # Same arguments as generate_level_data(), with a seed instead of an RNG
+    def generate(self, level, seed=None, width=SCREEN_WIDTH):
+        if level in LEVEL_PLATFORMS:
+            return generate_level_data(level, random if seed is None else level_rng(seed, level), width)
+        if seed is None:
+            return self.generate_unseeded(level, width)
+        
+        key = (level, seed, width)
+        with self.lock:
+            data = self.levels.get(key)
+            if data is not None:
+                self.levels.move_to_end(key)
+                self.hits += 1
+                return data
+        
+        attempt = self.first_valid_attempt(level, seed, width)
+        if attempt is None:
+            data = drop_unreachable_coins(generate_level_data(level, candidate_rng(seed, level, 0), width),
+                                          candidate_rng(seed, level, MAX_LEVEL_ATTEMPTS))
+        else:
+            data = generate_level_data(level, candidate_rng(seed, level, attempt), width)
+        with self.lock:
+            self.generated += 1
+            self.rejected += MAX_LEVEL_ATTEMPTS if attempt is None else attempt
+            self.repaired += attempt is None
+            self.levels[key] = data
+            if len(self.levels) > self.cache_size:
+                self.levels.popitem(last=False)
+        return data
+    
+    # Unseeded levels are only played once, they are checked but not cached
+    def generate_unseeded(self, level, width):
+        for _ in range(MAX_LEVEL_ATTEMPTS):
+            data = generate_level_data(level, random, width)
+            if len(level_reachability(data)[1]) == len(data.coins):
+                return data
+        return drop_unreachable_coins(data, random)
+    
+    # Index of the first candidate with every coin reachable, or None
+    def first_valid_attempt(self, level, seed, width):
+        with self.lock:
+            executor = self.executor
+            processes = self.processes
+        if executor is None:
+            return check_level_candidates(level, seed, width, 0, MAX_LEVEL_ATTEMPTS)
+        
+        # Each process checks a run of candidates, stopping at its first valid
+        # one; the earliest run with a valid candidate has the answer
+        size = -(-MAX_LEVEL_ATTEMPTS // processes)
+        futures = [executor.submit(check_level_candidates, level, seed, width, first,
+                                   min(size, MAX_LEVEL_ATTEMPTS - first))
+                   for first in range(0, MAX_LEVEL_ATTEMPTS, size)]
+        for i, future in enumerate(futures):
+            attempt = future.result()
+            if attempt is not None:
+                for later in futures[i + 1:]:
+                    later.cancel()
+                return attempt
+        return None
+    
+    # Call from the main thread, before the display is set up: the pool's
+    # processes are started right away, from a fresh interpreter rather than
+    # a fork of this one
+    def set_processes(self, processes):
+        self.shutdown()
+        with self.lock:
+            self.processes = processes
+            if processes > 1:
+                # The workers import pygame again, without greeting every time
+                os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+                self.executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+                for _ in range(processes):
+                    self.executor.submit(get_jump_envelope)
+    
+    def stats(self):
+        with self.lock:
+            return {'generated': self.generated, 'rejected': self.rejected, 'repaired': self.repaired,
+                    'hits': self.hits}
+    
+    def shutdown(self):
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown()
+
+level_generator = LevelGenerator()
+
+# Everything a level needs to be played: its world with the chunks around the
+# spawn point loaded, and a fresh player. Levels with a file in level_dir are
+# loaded from it, the others are generated.
+def build_level(level, seed=None, width=SCREEN_WIDTH, level_dir=None):
+    if level_dir:
+        path = level_path(level_dir, level)
+        if os.path.exists(path):
+            return prepare_level(LevelFile(path))
+    return prepare_level(level_generator.generate(level, seed, width))
+
+def prepare_level(source):
+    world = ChunkedWorld(source)
+    player = sprite_pool.acquire(Player)
+    world.update_view(view_left(player.rect.centerx, world.width))
+    return world, player
+
+# Done-callback for a prefetched level nobody is going to play
+def release_prepared(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    world, player = future.result()
+    world.release()
+    sprite_pool.release(player)
+
+# Builds the next level on a worker thread while the current one is played,
+# so the transition only has to swap it in
+class LevelPrefetcher:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="level-prefetch")
+        # build_level() arguments of the level being built
+        self.key = None
+        self.future = None
+        # Transitions served from a finished prefetch vs. built synchronously
+        self.hits = 0
+        self.misses = 0
+    
+    # Arguments are the same as for build_level()
+    def prefetch(self, *args):
+        if self.future is not None and self.key == args:
+            return
+        self.discard()
+        self.key = args
+        self.future = self.executor.submit(build_level, *args)
+    
+    def take(self, *args):
+        future = self.future
+        if future is not None and self.key == args and future.done():
+            self.future = None
+            self.key = None
+            self.hits += 1
+            return future.result()
+        
+        # Not ready yet (or a different level): build it here instead
+        self.discard()
+        self.misses += 1
+        return build_level(*args)
+    
+    def discard(self):
+        # A build that already started is released once it is done, so its
+        # sprites go back to the pool and its level file gets closed
+        if self.future is not None and not self.future.cancel():
+            self.future.add_done_callback(release_prepared)
+        self.future = None
+        self.key = None
+    
+    def shutdown(self):
+        self.discard()
+        self.executor.shutdown(wait=False)
+
+# Struct-of-arrays state of the active enemies of a level, stepped with a
+# handful of NumPy operations per tick. The Enemy sprites become views that are
+# only brought up to date by sync() before drawing, their spatial grid entries
+# included.
+class EnemyArrays:
+    def __init__(self, enemies):
+        self.sprites = list(enemies)
+        self.x = np.array([enemy.x for enemy in self.sprites], dtype=float)
+        self.rect_x = np.array([enemy.rect.x for enemy in self.sprites], dtype=float)
+        self.prev_x = self.rect_x.copy()
+        self.y = np.array([enemy.rect.y for enemy in self.sprites], dtype=float)
+        self.width = np.array([enemy.rect.width for enemy in self.sprites], dtype=float)
+        self.height = np.array([enemy.rect.height for enemy in self.sprites], dtype=float)
+        self.min_x = np.array([enemy.min_x for enemy in self.sprites], dtype=float)
+        self.max_x = np.array([enemy.max_x for enemy in self.sprites], dtype=float)
+        self.velocity = np.array([enemy.velocity for enemy in self.sprites], dtype=float)
+        self.facing_right = np.array([enemy.facing_right for enemy in self.sprites], dtype=bool)
+    
+    def step(self, dt):
+        self.prev_x = self.rect_x
+        self.x += self.velocity * dt
+        self.rect_x = np.round(self.x)
+        self.facing_right = self.velocity > 0
+        bounce = (self.rect_x <= self.min_x) | (self.rect_x + self.width >= self.max_x)
+        self.velocity[bounce] *= -1
+    
+    def overlaps(self, rect):
+        return ((self.rect_x < rect.right) & (self.rect_x + self.width > rect.left) &
+                (self.y < rect.bottom) & (self.y + self.height > rect.top))
+    
+    def collides(self, rect):
+        return bool(self.overlaps(rect).any())
+    
+    def sync(self, grid):
+        for i in np.flatnonzero(self.facing_right != [enemy.facing_right for enemy in self.sprites]):
+            enemy = self.sprites[i]
+            enemy.facing_right = bool(self.facing_right[i])
+            enemy.image = sprite_variants.get(enemy.original_image, flip=not enemy.facing_right)
+        for enemy, x, rect_x, prev_x, velocity in zip(self.sprites, self.x.tolist(), self.rect_x.tolist(),
+                                                     self.prev_x.tolist(), self.velocity.tolist()):
+            enemy.x = x
+            enemy.velocity = velocity
+            enemy.prev_pos = (int(prev_x), enemy.rect.y)
+            enemy.rect.x = int(rect_x)
+            grid.move(enemy)
+
+# Struct-of-arrays state of the active coins of a level; see EnemyArrays
+class CoinArrays:
+    def __init__(self, coins):
+        self.sprites = list(coins)
+        self.x = np.array([coin.rect.x for coin in self.sprites], dtype=float)
+        self.rect_y = np.array([coin.rect.y for coin in self.sprites], dtype=float)
+        self.prev_y = self.rect_y.copy()
+        self.original_y = np.array([coin.original_y for coin in self.sprites], dtype=float)
+        self.width = np.array([coin.rect.width for coin in self.sprites], dtype=float)
+        self.height = np.array([coin.rect.height for coin in self.sprites], dtype=float)
+        self.timer = np.array([coin.animation_timer for coin in self.sprites], dtype=float)
+        self.alive = np.ones(len(self.sprites), dtype=bool)
+    
+    def step(self, dt):
+        self.prev_y = self.rect_y
+        self.timer += 0.1 * dt
+        self.rect_y = self.original_y + np.trunc(3 * np.sin(self.timer))
+    
+    # Remove the coins the rect touches and return their sprites
+    def collect(self, rect):
+        hits = np.flatnonzero(self.alive &
+                              (self.x < rect.right) & (self.x + self.width > rect.left) &
+                              (self.rect_y < rect.bottom) & (self.rect_y + self.height > rect.top))
+        self.alive[hits] = False
+        collected = [self.sprites[i] for i in hits]
+        for coin in collected:
+            coin.kill()
+        return collected
+    
+    def sync(self, grid):
+        for coin, alive, rect_y, prev_y, timer in zip(self.sprites, self.alive.tolist(), self.rect_y.tolist(),
+                                                     self.prev_y.tolist(), self.timer.tolist()):
+            if alive:
+                coin.animation_timer = timer
+                coin.prev_pos = (coin.rect.x, int(prev_y))
+                coin.rect.y = int(rect_y)
+                grid.move(coin)
+
+# One play session: the current level, the player and the score/lives rules.
+# The simulation only advances through step(), one fixed tick at a time.
+class Game:
+    def __init__(self, level=1, tick_rate=TICK_RATE, prefetcher=None, seed=None, profiler=None,
+                 vectorized=False, level_width=SCREEN_WIDTH, level_dir=None):
+        self.tick_rate = tick_rate
+        # Width of the generated levels, wider than the screen scrolls
+        self.level_width = level_width
+        # Directory of level files that replace the built-in levels
+        self.level_dir = level_dir
+        self.world = None
+        self.prefetcher = prefetcher
+        self.profiler = profiler
+        # Step enemies and coins as arrays (needs NumPy) instead of one sprite at a time
+        self.vectorized = vectorized and np is not None
+        self.enemy_arrays = None
+        self.coin_arrays = None
+        # All level randomness comes from the seed, which makes a session
+        # reproducible from its seed and inputs
+        self.seed = random.getrandbits(64) if seed is None else seed
+        # Length of one tick in units of the base tick the constants are tuned for
+        self.dt = BASE_TICK_RATE / tick_rate
+        self.score = 0
+        self.lives = 3
+        self.ticks = 0
+        self.game_over = False
+        self.load_level(level)
+    
+    def load_level(self, level):
+        # The old level's sprites can be reused by a level built right now
+        self.release_level()
+        if self.prefetcher:
+            prepared = self.prefetcher.take(level, self.seed, self.level_width, self.level_dir)
+        else:
+            prepared = build_level(level, self.seed, self.level_width, self.level_dir)
+        self.set_level(level, prepared)
+        if self.prefetcher:
+            self.prefetcher.prefetch(level + 1, self.seed, self.level_width, self.level_dir)
+    
+    # Swap in a level prepared by build_level() or prepare_level()
+    def set_level(self, level, prepared):
+        self.release_level()
+        self.level = level
+        self.world, self.player = prepared
+        # The groups only hold the loaded chunks of the level
+        self.platforms = self.world.platforms
+        self.coins = self.world.coins
+        self.enemies = self.world.enemies
+        if self.vectorized:
+            self.build_arrays()
+    
+    # Hand the sprites of the current level back to the pool. Nothing may use
+    # them afterwards, the game needs a new level (or is finished).
+    def release_level(self):
+        if self.world is None:
+            return
+        self.world.release()
+        sprite_pool.release(self.player)
+        self.world = None
+        self.player = None
+        self.enemy_arrays = None
+        self.coin_arrays = None
+    
+    def build_arrays(self):
+        self.enemy_arrays = EnemyArrays(self.world.active_enemies)
+        self.coin_arrays = CoinArrays(self.world.active_coins)
+    
+    # Bring the enemy and coin sprites up to date before they are drawn
+    def sync_sprites(self):
+        if self.vectorized:
+            self.enemy_arrays.sync(self.enemies.grid)
+            self.coin_arrays.sync(self.coins.grid)
+    
+    # Left edge of the view, following the player drawn at alpha
+    def camera_x(self, alpha=1.0):
+        player = self.player
+        x = interpolated_position(player, alpha)[0] + player.rect.width // 2
+        return view_left(x, self.world.width)
+    
+    # Moving sprites overlapping the view at camera_x, the player last
+    def visible_sprites(self, camera_x=0):
+        view = pygame.Rect(camera_x, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+        return self.world.visible_sprites(view) + [self.player]
+    
+    def step(self, inputs):
+        player = self.player
+        if inputs & INPUT_JUMP:
+            player.jump()
+        if inputs & INPUT_LEFT:
+            player.move_left()
+        elif inputs & INPUT_RIGHT:
+            player.move_right()
+        else:
+            player.stop()
+        
+        profiler = self.profiler
+        
+        # Update game state
+        world = self.world
+        player.update(self.platforms, self.dt, world.width)
+        self.stream_chunks()
+        if self.vectorized:
+            self.enemy_arrays.step(self.dt)
+            self.coin_arrays.step(self.dt)
+        else:
+            self.enemies.update_members(world.active_enemies, self.dt)
+            self.coins.update_members(world.active_coins, self.dt)
+        if profiler:
+            profiler.mark('update')
+        
+        # Check for coin collisions
+        if self.vectorized:
+            coin_hits = self.coin_arrays.collect(player.rect)
+        else:
+            coin_hits = collide_group(player, self.coins)
+        for coin in coin_hits:
+            world.collect(coin)
+        self.score += 10 * len(coin_hits)
+        
+        # Check if all coins are collected
+        if world.coins_remaining == 0:
+            if profiler:
+                profiler.mark('collisions')
+            self.load_level(self.level + 1)
+            player = self.player
+            if profiler:
+                profiler.mark('level_load')
+        
+        # Check for enemy collisions
+        if self.vectorized:
+            enemy_hit = self.enemy_arrays.collides(player.rect)
+        else:
+            enemy_hit = bool(collide_group(player, self.enemies))
+        if enemy_hit:
+            self.lose_life()
+        
+        # Check if player fell off the screen
+        if player.rect.top > SCREEN_HEIGHT:
+            self.lose_life()
+        
+        self.ticks += 1
+        if profiler:
+            profiler.mark('collisions')
+    
+    # Load the chunks around the simulated (not the drawn) player position
+    # so the simulation doesn't depend on the frame rate
+    def stream_chunks(self):
+        world = self.world
+        left = view_left(self.player.rect.centerx, world.width)
+        if world.view_changes(left):
+            # Unloaded sprites go back to the pool, the arrays must let go first
+            if self.vectorized:
+                self.sync_sprites()
+            world.update_view(left)
+            if self.vectorized:
+                self.build_arrays()
+    
+    def lose_life(self):
+        self.lives -= 1
+        self.player.respawn()
+        # The respawn point may be far from the loaded chunks, the next frame
+        # and tick need the ones around it
+        self.stream_chunks()
+        if self.lives <= 0:
+            self.game_over = True
+    
+    # 64-bit digest of the simulation state, equal for bit-exact replays
+    def state_digest(self):
+        self.sync_sprites()
+        player = self.player
+        state = (self.ticks, self.score, self.lives, self.level, self.game_over,
+                 player.rect.topleft, player.x, player.y, player.velocity_x, player.velocity_y,
+                 sorted(self.world.collected),
+                 [coin.rect.topleft for coin in self.coins],
+                 [(enemy.x, float(enemy.velocity)) for enemy in self.enemies])
+        digest = hashlib.blake2b(repr(state).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+# HUD text that is only re-rendered when its value changes
+class HudLabel:
+    def __init__(self, template, size, color, x, y):
+        self.template = template
+        self.size = size
+        self.color = color
+        self.pos = (x, y)
+        self.value = None
+        self.image = None
+        self.rect = None
+    
+    def set_value(self, value):
+        if self.image is not None and value == self.value:
+            return False
+        self.value = value
+        self.image = text_cache.render(self.template.format(value), self.size, self.color)
+        self.rect = self.image.get_rect(midtop=self.pos)
+        return True
+    
+    def draw(self, surface, value):
+        self.set_value(value)
+        surface.blit(self.image, self.rect)
+        return self.rect
+
+# Toggleable overlay with the profiler's rolling phase averages and p99 frame
+# time. Has the same set_value/image/rect interface as HudLabel.
+class ProfilerOverlay:
+    def __init__(self, x=10, y=50, refresh_interval=0.5):
+        self.pos = (x, y)
+        self.refresh_interval = refresh_interval
+        self.next_refresh = 0.0
+        self.image = None
+        self.rect = None
+    
+    def set_value(self, profiler):
+        now = time.perf_counter()
+        if self.image is not None and now < self.next_refresh:
+            return False
+        self.next_refresh = now + self.refresh_interval
+        
+        lines = [f"frame {profiler.mean_frame_time():.2f} ms  p99 {profiler.percentile(99):.2f} ms"]
+        lines.extend(f"{phase} {ms:.2f} ms" for phase, ms in profiler.averages().items())
+        # The numbers change on every refresh, so they bypass the text cache
+        font = get_font(20)
+        rendered = [font.render(line, True, WHITE) for line in lines]
+        
+        width = max(line.get_width() for line in rendered) + 8
+        height = sum(line.get_height() for line in rendered) + 8
+        self.image = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.image.fill((0, 0, 0, 160))
+        y = 4
+        for line in rendered:
+            self.image.blit(line, (4, y))
+            y += line.get_height()
+        self.rect = self.image.get_rect(topleft=self.pos)
+        return True
+    
+    def draw(self, surface, profiler):
+        self.set_value(profiler)
+        surface.blit(self.image, self.rect)
+        return self.rect
+
+# Layout of a menu-style screen: a dark overlay over the game with centred
+# text lines (template, size, color, y) and buttons. Templates are formatted
+# with the values the screen is drawn with.
+class StaticScreen:
+    def __init__(self, overlay_alpha, lines, buttons=()):
+        self.overlay_alpha = overlay_alpha
+        self.lines = lines
+        self.buttons = buttons
+
+# Draws static screens over a still of the game. Nothing is drawn while the
+# screen, its values and the hover state of its buttons stay the same, so an
+# idle menu costs nothing but the event polling.
+class ScreenCompositor:
+    def __init__(self):
+        self.overlays = {}
+        self.drawn = None
+    
+    # Returns True when the surface was redrawn and needs presenting
+    def draw(self, surface, static_screen, scene, values=()):
+        key = (static_screen, values, tuple(button.is_hovered for button in static_screen.buttons))
+        if key == self.drawn:
+            return False
+        self.drawn = key
+        
+        overlay = self.overlays.get(static_screen.overlay_alpha)
+        if overlay is None:
+            overlay = pygame.Surface(surface.get_size(), pygame.SRCALPHA)
+            overlay.fill((0, 0, 0, static_screen.overlay_alpha))
+            self.overlays[static_screen.overlay_alpha] = overlay
+        surface.blit(scene, (0, 0))
+        surface.blit(overlay, (0, 0))
+        
+        for template, size, color, y in static_screen.lines:
+            text_surface = text_cache.render(template.format(*values), size, color)
+            surface.blit(text_surface, text_surface.get_rect(midtop=(surface.get_width() // 2, y)))
+        for button in static_screen.buttons:
+            button.draw(surface)
+        return True
+    
+    # Redraw on the next draw(), e.g. after the scene behind changed
+    def invalidate(self):
+        self.drawn = None
+
+# Sky colour and tileable parallax layers of a level's background, rendered
+# once per theme. A layer is a strip of pre-drawn clouds or stars that
+# repeats every `period` pixels and scrolls with the clock and, slower, with
+# the camera. Drawing the background is then a fill plus a couple of blits
+# per layer however many elements the strips hold.
+class BackgroundCache:
+    def __init__(self):
+        self.themes = {}
+    
+    def get(self, level):
+        theme = min(level, 3)
+        cached = self.themes.get(theme)
+        if cached is None:
+            cached = self.themes[theme] = self.build(theme)
+        return cached
+    
+    def build(self, theme):
+        if theme == 1:
+            sky_color = SKY_BLUE
+        elif theme == 2:
+            sky_color = (100, 150, 200)  # Evening sky
+        else:
+            sky_color = (20, 20, 50)  # Night sky
+        
+        if theme <= 2:
+            # Clouds: band from y=50, moving 1px every 50ms and at a quarter
+            # of the camera speed
+            strip = self.new_strip(SCREEN_WIDTH + 200, 150)
+            for i in range(5):
+                pygame.draw.ellipse(strip, WHITE, (i * 200, i * 30, 70, 30))
+            layers = [(strip, 50, -100, 50, 4)]
+        else:
+            # Stars: 1px every 100ms and an eighth of the camera speed
+            strip = self.new_strip(SCREEN_WIDTH, SCREEN_HEIGHT - 98)
+            for i in range(20):
+                # The first star wraps around the strip's edge
+                for x in (i * 40, i * 40 + SCREEN_WIDTH):
+                    pygame.draw.circle(strip, WHITE, (x, i * 25 % (SCREEN_HEIGHT - 100) + 2), 2)
+            layers = [(strip, -2, 0, 100, 8)]
+        # Layers are (strip, y, x shift, milliseconds per pixel, camera divisor)
+        return sky_color, layers
+    
+    # Strips are mostly empty, so they are colour keyed and run-length
+    # encoded: blitting one skips the gaps and only copies the elements' pixels
+    def new_strip(self, width, height):
+        strip = pygame.Surface((width, height))
+        if pygame.display.get_surface() is not None:
+            strip = strip.convert()
+        strip.fill(COLOR_KEY)
+        strip.set_colorkey(COLOR_KEY, pygame.RLEACCEL)
+        return strip
+    
+    # Layers are converted for the display, rebuild them after it changes
+    def clear(self):
+        self.themes.clear()
+
+background_cache = BackgroundCache()
+
+# Draw background with parallax effect, scrolled along with the camera at a
+# fraction of its speed
+def draw_background(level, surface=None, ticks=None, camera_x=0):
+    if surface is None:
+        surface = get_screen()
+    if ticks is None:
+        ticks = game_ticks()
+    
     # Sky
-    if level == 1:
-        sky_color = SKY_BLUE
-    elif level == 2:
-        sky_color = (100, 150, 200)  # Evening sky
-    else:
-        sky_color = (20, 20, 50)  # Night sky
+    sky_color, layers = background_cache.get(level)
+    surface.fill(sky_color)
+    
+    # Clouds or stars, tiled across the screen
+    width = surface.get_width()
+    for strip, y, shift, tick_divisor, camera_divisor in layers:
+        period = strip.get_width()
+        x = (ticks // tick_divisor - camera_x // camera_divisor) % period + shift
+        while x > 0:
+            x -= period
+        blits = []
+        while x < width:
+            blits.append((strip, (x, y)))
+            x += period
+        surface.blits(blits, False)
+
+# Position to draw a sprite at, interpolated between its last two simulation
+# ticks. Sprites that don't move have no previous position.
+def interpolated_position(sprite, alpha):
+    prev_pos = getattr(sprite, 'prev_pos', None)
+    if prev_pos is None or alpha >= 1.0:
+        return sprite.rect.topleft
+    x, y = sprite.rect.topleft
+    return (round(prev_pos[0] + (x - prev_pos[0]) * alpha),
+            round(prev_pos[1] + (y - prev_pos[1]) * alpha))
+
+# Draw sprites, optionally at interpolated positions, relative to the camera
+def draw_sprites(surface, sprites, alpha=1.0, camera_x=0):
+    if alpha >= 1.0 and camera_x == 0 and isinstance(sprites, pygame.sprite.Group):
+        sprites.draw(surface)
+        return
+    blits = []
+    for sprite in sprites:
+        x, y = interpolated_position(sprite, alpha)
+        blits.append((sprite.image, (x - camera_x, y)))
+    surface.blits(blits, False)
+
+# Draw the level in view: the baked platform layers of the visible chunks,
+# then the coins, enemies and the player
+def draw_level(surface, game, alpha=1.0, camera_x=0):
+    view = pygame.Rect(camera_x, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+    surface.blits([(layer, (x - camera_x, y)) for layer, x, y in game.world.visible_layers(view)], False)
+    draw_sprites(surface, game.visible_sprites(camera_x), alpha, camera_x)
+
+# Score, lives and level labels of the HUD
+def create_hud_labels():
+    return (HudLabel("Score: {}", 36, WHITE, 100, 10),
+            HudLabel("Lives: {}", 36, WHITE, 700, 10),
+            HudLabel("Level: {}", 36, WHITE, SCREEN_WIDTH // 2, 10))
+
+# Draw a frame of the game being played the way the main loop does, for runs
+# without one. The background moves with simulation time, so a session's
+# frames come out the same on every run.
+def draw_game_frame(surface, game, labels):
+    game.sync_sprites()
+    camera_x = game.camera_x()
+    draw_background(game.level, surface, game.ticks * 1000 // game.tick_rate, camera_x)
+    draw_level(surface, game, camera_x=camera_x)
+    for label, value in zip(labels, (game.score, game.lives, game.level)):
+        label.draw(surface, value)
+
+# Dirty-rectangle renderer: the background and static platforms are baked into
+# one surface, and each frame only the areas touched by moving sprites and HUD
+# labels are restored and redrawn
+class DirtyRenderer:
+    def __init__(self, surface):
+        self.surface = surface
+        self.background = pygame.Surface(surface.get_size()).convert()
+        self.sprites = pygame.sprite.Group()
+        # Screen rects each sprite was drawn to in the previous frame
+        self.drawn_rects = []
+        self.needs_full_redraw = True
     
-    screen.fill(sky_color)
+    def set_scene(self, level, platforms, *moving_sprites):
+        # Clouds and stars are frozen in the cached background
+        draw_background(level, self.background, ticks=0)
+        platforms.draw(self.background)
+        self.sprites = pygame.sprite.Group(*moving_sprites)
+        self.invalidate()
     
-    # Draw clouds or stars based on level
-    if level <= 2:
-        # Draw clouds
-        for i in range(5):
-            cloud_x = (pygame.time.get_ticks() // 50 + i * 200) % (SCREEN_WIDTH + 200) - 100
-            cloud_y = 50 + i * 30
-            pygame.draw.ellipse(screen, WHITE, (cloud_x, cloud_y, 70, 30))
-    else:
-        # Draw stars
-        for i in range(20):
-            star_x = (i * 40 + pygame.time.get_ticks() // 100) % SCREEN_WIDTH
-            star_y = i * 25 % (SCREEN_HEIGHT - 100)
-            pygame.draw.circle(screen, WHITE, (star_x, star_y), 2)
+    def invalidate(self):
+        self.needs_full_redraw = True
+    
+    def draw(self, labels, alpha=1.0):
+        # labels is a list of (HudLabel, value) pairs drawn on top of the sprites
+        surface = self.surface
+        background = self.background
+        if self.needs_full_redraw:
+            surface.blit(background, (0, 0))
+        else:
+            for rect in self.drawn_rects:
+                surface.blit(background, rect, rect)
+        
+        sprite_rects = [sprite.image.get_rect(topleft=interpolated_position(sprite, alpha))
+                        for sprite in self.sprites]
+        
+        # Rects whose pixels were just restored or are about to be drawn over
+        touched = self.drawn_rects + sprite_rects
+        dirty = list(self.drawn_rects)
+        redraw = []
+        for label, value in labels:
+            old_rect = label.rect
+            if label.set_value(value) or self.needs_full_redraw or old_rect is None \
+                    or old_rect.collidelist(touched) != -1:
+                if old_rect is not None:
+                    surface.blit(background, old_rect, old_rect)
+                    dirty.append(old_rect)
+                redraw.append(label)
+        
+        for sprite, rect in zip(self.sprites, sprite_rects):
+            surface.blit(sprite.image, rect)
+        dirty.extend(sprite_rects)
+        self.drawn_rects = sprite_rects
+        
+        for label in redraw:
+            surface.blit(label.image, label.rect)
+            dirty.append(label.rect)
+        
+        if self.needs_full_redraw:
+            self.needs_full_redraw = False
+            return [surface.get_rect()]
+        return dirty
+
+# Read the movement keys into input bits for the next simulation tick
+def read_keyboard(jump_pressed=False):
+    inputs = INPUT_JUMP if jump_pressed else 0
+    keys = pygame.key.get_pressed()
+    if keys[pygame.K_LEFT] or keys[pygame.K_a]:
+        inputs |= INPUT_LEFT
+    elif keys[pygame.K_RIGHT] or keys[pygame.K_d]:
+        inputs |= INPUT_RIGHT
+    return inputs
+
+# Scripted input for headless runs: comma separated "<keys>*<ticks>" segments,
+# where keys is any combination of L, R and J (jump), e.g. "R*120,RJ*1,*30".
+# The script repeats once it runs out.
+class ScriptedInput:
+    def __init__(self, script):
+        self.inputs = []
+        for segment in script.split(','):
+            keys, _, count = segment.strip().partition('*')
+            bits = 0
+            for key in keys.upper():
+                if key == 'L':
+                    bits |= INPUT_LEFT
+                elif key == 'R':
+                    bits |= INPUT_RIGHT
+                elif key == 'J':
+                    bits |= INPUT_JUMP
+                else:
+                    raise ValueError(f"Unknown key {key!r} in input script segment {segment!r}")
+            self.inputs.extend([bits] * int(count or 1))
+        if not self.inputs:
+            raise ValueError("Input script is empty")
+    
+    def __call__(self, game):
+        return self.inputs[game.ticks % len(self.inputs)]
+
+# Random input that holds each direction for a while and jumps now and then
+class RandomInput:
+    def __init__(self, seed=None, hold_ticks=30, jump_chance=0.05):
+        self.rng = random.Random(seed)
+        self.hold_ticks = hold_ticks
+        self.jump_chance = jump_chance
+        self.direction = 0
+    
+    def __call__(self, game):
+        if game.ticks % self.hold_ticks == 0:
+            self.direction = self.rng.choice((0, INPUT_LEFT, INPUT_RIGHT))
+        if self.rng.random() < self.jump_chance:
+            return self.direction | INPUT_JUMP
+        return self.direction
+
+# Run one session without a window, rendering or frame cap. input_source is
+# called with the Game before every tick and returns its input bits, which are
+# passed to the recorder if there is one. With a FrameCapture every
+# capture_every-th tick is drawn offscreen and captured.
+def run_headless(ticks, input_source=None, level=1, tick_rate=TICK_RATE, seed=None, recorder=None,
+                 vectorized=False, level_width=SCREEN_WIDTH, level_dir=None, capture=None, capture_every=1):
+    game = Game(level, tick_rate, seed=seed, vectorized=vectorized, level_width=level_width,
+                level_dir=level_dir)
+    if capture:
+        surface = init_game()
+        labels = create_hud_labels()
+    start = time.perf_counter()
+    while game.ticks < ticks and not game.game_over:
+        inputs = input_source(game) if input_source else 0
+        if recorder:
+            recorder.record(inputs)
+        game.step(inputs)
+        if capture and game.ticks % capture_every == 0:
+            draw_game_frame(surface, game, labels)
+            # Nothing has to keep up with real time, so no frame is dropped
+            capture.capture(surface, wait=True)
+    elapsed = time.perf_counter() - start
+    
+    result = {
+        'seed': game.seed,
+        'digest': game.state_digest(),
+        'ticks': game.ticks,
+        'seconds': elapsed,
+        'ticks_per_second': game.ticks / elapsed if elapsed > 0 else float('inf'),
+        'score': game.score,
+        'lives': game.lives,
+        'level': game.level,
+        'game_over': game.game_over,
+    }
+    # The next session reuses this one's sprites
+    game.release_level()
+    return result
+
+# Re-simulate a recorded session at maximum speed and check that it ends in
+# exactly the recorded state. Sessions played on level files need the same
+# level_dir again.
+def run_replay(path, vectorized=False, level_dir=None, capture=None, capture_every=1):
+    replay = InputReplay.load(path)
+    result = run_headless(replay.ticks, replay, replay.level, replay.tick_rate, replay.seed,
+                          vectorized=vectorized, level_width=replay.level_width, level_dir=level_dir,
+                          capture=capture, capture_every=capture_every)
+    result['matches'] = result['ticks'] == replay.ticks and result['digest'] == replay.digest
+    return result
 
 # Main game loop
-def main():
-    # Game variables
-    score = 0
-    lives = 3
-    level = 1
+def main(dirty_rects=False, tick_rate=TICK_RATE, fps=FPS, interpolate=False, report_startup=False,
+         seed=None, record_path=None, replay_path=None, show_profiler=False, profile_path=None,
+         vectorized=False, level_width=SCREEN_WIDTH, level_dir=None, scale_mode='none', window_size=None,
+         fullscreen=False, capture_path=None, capture_buffers=CAPTURE_BUFFERS):
+    init_game(scale_mode, window_size, fullscreen)
     game_state = MENU
+    prefetcher = LevelPrefetcher()
     
-    # Create sprite groups
-    all_sprites = pygame.sprite.Group()
-    platforms = pygame.sprite.Group()
-    coins = pygame.sprite.Group()
-    enemies = pygame.sprite.Group()
+    # Frame phase timings, shown with F3 and written to profile_path on exit
+    profiler = FrameProfiler(keep_history=profile_path is not None)
+    profiler_overlay = ProfilerOverlay()
     
-    # Create platforms, coins, and enemies
-    platforms, coins, enemies = create_level(level)
-    all_sprites.add(platforms)
-    all_sprites.add(coins)
-    all_sprites.add(enemies)
+    # Every frame shown is also copied to the capture, dropped if its writer falls behind
+    capture = FrameCapture(capture_path, screen, capture_buffers) if capture_path else None
     
-    # Create player
-    player = Player()
-    all_sprites.add(player)
+    # A replay re-runs a recorded session in real time instead of reading the keyboard
+    replay = None
+    if replay_path:
+        replay = InputReplay.load(replay_path)
+        tick_rate = replay.tick_rate
+        level_width = replay.level_width
+        game = Game(replay.level, tick_rate, prefetcher, replay.seed, profiler, vectorized, level_width,
+                    level_dir)
+        game_state = PLAYING
+    else:
+        game = Game(tick_rate=tick_rate, prefetcher=prefetcher, seed=seed, profiler=profiler,
+                    vectorized=vectorized, level_width=level_width, level_dir=level_dir)
+    
+    # The first session is recorded until it ends
+    recorder = None
+    if record_path:
+        recorder = InputRecorder(game.seed, tick_rate, game.level, level_width)
+    
+    if report_startup:
+        print(startup_report())
+    
+    # Optional dirty-rectangle renderer
+    renderer = None
+    if dirty_rects:
+        renderer = DirtyRenderer(screen)
+        renderer.set_scene(game.level, game.platforms, game.coins, game.enemies, game.player)
     
     # Create menu buttons
     start_button = Button(SCREEN_WIDTH//2 - 100, SCREEN_HEIGHT//2, 200, 50, "Start Game", GREEN, (100, 255, 100), 
@@ -343,39 +2007,80 @@ def main():
     back_button = Button(SCREEN_WIDTH//2 - 100, SCREEN_HEIGHT - 100, 200, 50, "Back", BLUE, (100, 100, 255), 
                         lambda: "back")
     
+    # Menu screens
+    menu_screen = StaticScreen(128, [("ENHANCED PLATFORMER", 64, WHITE, SCREEN_HEIGHT // 6)],
+                               [start_button, controls_button, quit_button])
+    controls = [
+        "Arrow Keys / A,D - Move Left/Right",
+        "Space / Up / W - Jump",
+        "ESC - Return to Menu",
+        "",
+        "Collect all coins to advance to next level",
+        "Avoid enemies or lose a life",
+        "Game ends when all lives are lost"
+    ]
+    controls_screen = StaticScreen(192, [("CONTROLS", 64, WHITE, 50)] +
+                                   [(line, 30, WHITE, 150 + i * 40) for i, line in enumerate(controls)],
+                                   [back_button])
+    game_over_screen = StaticScreen(128, [
+        ("GAME OVER", 64, RED, SCREEN_HEIGHT // 4),
+        ("Final Score: {0}", 48, WHITE, SCREEN_HEIGHT // 2 - 50),
+        ("Levels Completed: {1}", 36, WHITE, SCREEN_HEIGHT // 2),
+        ("Press ENTER to play again", 36, WHITE, SCREEN_HEIGHT // 2 + 50),
+    ], [back_button])
+    compositor = ScreenCompositor()
+    # Still of the game shown behind the menu screens
+    scene = None
+    
+    # HUD labels
+    score_label, lives_label, level_label = create_hud_labels()
+    
+    # Fixed timestep: real time is accumulated and consumed in whole ticks
+    tick_time = 1.0 / tick_rate
+    accumulator = 0.0
+    last_time = time.perf_counter()
+    # Jump presses are latched until the next simulation tick consumes them
+    jump_pressed = False
+    
     running = True
     
     while running:
-        mouse_pos = pygame.mouse.get_pos()
+        profiler.begin_frame()
+        now = time.perf_counter()
+        frame_time = min(now - last_time, MAX_FRAME_TIME)
+        last_time = now
+        mouse_pos = window_to_screen(pygame.mouse.get_pos())
+        previous_state = game_state
         
         # Handle events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                show_profiler = not show_profiler
+                # The overlay is drawn over a menu screen, which has to be
+                # redrawn to clear it
+                compositor.invalidate()
+                if renderer:
+                    renderer.invalidate()
+            
             elif event.type == pygame.KEYDOWN:
                 if game_state == PLAYING:
                     if event.key == pygame.K_SPACE or event.key == pygame.K_UP or event.key == pygame.K_w:
-                        player.jump()
+                        jump_pressed = True
                     elif event.key == pygame.K_ESCAPE:
                         game_state = MENU
                 
                 elif game_state == GAME_OVER:
                     if event.key == pygame.K_RETURN:
                         # Reset game
-                        score = 0
-                        lives = 3
-                        level = 1
+                        game.release_level()
+                        game = Game(tick_rate=tick_rate, prefetcher=prefetcher, profiler=profiler,
+                                    vectorized=vectorized, level_width=level_width, level_dir=level_dir)
                         game_state = PLAYING
-                        
-                        # Recreate level
-                        all_sprites = pygame.sprite.Group()
-                        platforms, coins, enemies = create_level(level)
-                        all_sprites.add(platforms)
-                        all_sprites.add(coins)
-                        all_sprites.add(enemies)
-                        player = Player()
-                        all_sprites.add(player)
+                        if renderer:
+                            renderer.set_scene(game.level, game.platforms, game.coins, game.enemies, game.player)
             
             # Handle button clicks
             if game_state == MENU:
@@ -383,6 +2088,13 @@ def main():
                     button.check_hover(mouse_pos)
                     action = button.handle_event(event)
                     if action == "start":
+                        # A finished game can't be resumed, start a new one
+                        if game.game_over:
+                            game.release_level()
+                            game = Game(tick_rate=tick_rate, prefetcher=prefetcher, profiler=profiler,
+                                    vectorized=vectorized, level_width=level_width, level_dir=level_dir)
+                            if renderer:
+                                renderer.set_scene(game.level, game.platforms, game.coins, game.enemies, game.player)
                         game_state = PLAYING
                     elif action == "controls":
                         game_state = CONTROLS
@@ -394,131 +2106,286 @@ def main():
                 action = back_button.handle_event(event)
                 if action == "back":
                     game_state = MENU
+        profiler.mark('events')
         
+        # The time spent on a menu, polled at IDLE_FPS, doesn't count towards
+        # the ticks played on resuming
+        if game_state == PLAYING and previous_state != PLAYING:
+            frame_time = 0.0
+        
+        alpha = 1.0
         if game_state == PLAYING:
-            # Get keyboard state for continuous movement
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-                player.move_left()
-            elif keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-                player.move_right()
-            else:
-                player.stop()
-            
-            # Update game state
-            player.update(platforms)
-            enemies.update()
-            coins.update()
-            
-            # Check for coin collisions
-            coin_hits = pygame.sprite.spritecollide(player, coins, True)
-            for coin in coin_hits:
-                score += 10
-            
-            # Check if all coins are collected
-            if len(coins) == 0:
-                level += 1
-                # Create new level
-                all_sprites = pygame.sprite.Group()
-                platforms, coins, enemies = create_level(level)
-                all_sprites.add(platforms)
-                all_sprites.add(coins)
-                all_sprites.add(enemies)
-                player = Player()
-                all_sprites.add(player)
-            
-            # Check for enemy collisions
-            enemy_hits = pygame.sprite.spritecollide(player, enemies, False)
-            if enemy_hits:
-                lives -= 1
-                player.rect.center = (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 2)
-                player.velocity_y = 0
+            accumulator += frame_time
+            while accumulator >= tick_time:
+                accumulator -= tick_time
+                if replay:
+                    if replay.finished():
+                        matches = game.ticks == replay.ticks and game.state_digest() == replay.digest
+                        print(f"Replay finished after {game.ticks} ticks, "
+                              f"{'matches' if matches else 'DOES NOT match'} the recording")
+                        running = False
+                        break
+                    inputs = replay(game)
+                else:
+                    inputs = read_keyboard(jump_pressed)
+                    jump_pressed = False
+                if recorder:
+                    recorder.record(inputs)
                 
-                if lives <= 0:
-                    game_state = GAME_OVER
-            
-            # Check if player fell off the screen
-            if player.rect.top > SCREEN_HEIGHT:
-                lives -= 1
-                player.rect.center = (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 2)
-                player.velocity_y = 0
+                level = game.level
+                game.step(inputs)
                 
-                if lives <= 0:
+                if renderer and game.level != level:
+                    renderer.set_scene(game.level, game.platforms, game.coins, game.enemies, game.player)
+                if game.game_over:
                     game_state = GAME_OVER
+                    if recorder:
+                        recorder.save(record_path, game.state_digest())
+                        recorder = None
+                    break
+            
+            if interpolate and game_state == PLAYING:
+                alpha = accumulator / tick_time
+        else:
+            accumulator = 0.0
+            jump_pressed = False
         
-        # Draw everything
-        draw_background(level)
-        
-        # Draw sprites
-        all_sprites.draw(screen)
+        game.sync_sprites()
         
-        # Draw score, lives and level
-        draw_text(f"Score: {score}", 36, WHITE, 100, 10)
-        draw_text(f"Lives: {lives}", 36, WHITE, 700, 10)
-        if game_state == PLAYING:
-            draw_text(f"Level: {level}", 36, WHITE, SCREEN_WIDTH // 2, 10)
+        # Only the regions that changed are pushed to the display while playing
+        # a level that doesn't scroll
+        if renderer and game_state == PLAYING and game.world.fits_view():
+            hud = [(score_label, game.score), (lives_label, game.lives), (level_label, game.level)]
+            if show_profiler:
+                hud.append((profiler_overlay, profiler))
+            dirty = renderer.draw(hud, alpha)
+            profiler.mark('draw')
+            if capture:
+                capture.capture(screen)
+                profiler.mark('capture')
+            present(dirty)
+            profiler.mark('present')
+            clock.tick(fps)
+            profiler.mark('wait')
+            profiler.end_frame()
+            continue
+        if renderer:
+            renderer.invalidate()
         
-        # Draw game state screens
-        if game_state == MENU:
-            # Semi-transparent overlay
-            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 128))
-            screen.blit(overlay, (0, 0))
+        # Draw everything, on menu screens only once for the still behind them
+        if game_state == PLAYING or scene is None:
+            camera_x = game.camera_x(alpha)
+            draw_background(game.level, camera_x=camera_x)
+            profiler.mark('background')
             
-            draw_text("ENHANCED PLATFORMER", 64, WHITE, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 6)
+            # Draw the platforms and sprites in view
+            draw_level(screen, game, alpha, camera_x)
+            profiler.mark('sprites')
             
-            # Draw buttons
-            start_button.draw(screen)
-            controls_button.draw(screen)
-            quit_button.draw(screen)
+            # Draw score, lives and level
+            score_label.draw(screen, game.score)
+            lives_label.draw(screen, game.lives)
+            if game_state == PLAYING:
+                level_label.draw(screen, game.level)
+                scene = None
+            else:
+                scene = screen.copy()
+                compositor.invalidate()
+            profiler.mark('hud')
         
+        # Draw game state screens
+        redrawn = True
+        if show_profiler:
+            # The overlay changes by itself, keep redrawing below it
+            compositor.invalidate()
+        if game_state == MENU:
+            redrawn = compositor.draw(screen, menu_screen, scene)
         elif game_state == CONTROLS:
-            # Semi-transparent overlay
-            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 192))
-            screen.blit(overlay, (0, 0))
-            
-            draw_text("CONTROLS", 64, WHITE, SCREEN_WIDTH // 2, 50)
-            
-            # Draw control instructions
-            controls = [
-                "Arrow Keys / A,D - Move Left/Right",
-                "Space / Up / W - Jump",
-                "ESC - Return to Menu",
-                "",
-                "Collect all coins to advance to next level",
-                "Avoid enemies or lose a life",
-                "Game ends when all lives are lost"
-            ]
-            
-            for i, line in enumerate(controls):
-                draw_text(line, 30, WHITE, SCREEN_WIDTH // 2, 150 + i * 40)
-            
-            # Draw back button
-            back_button.draw(screen)
-        
+            redrawn = compositor.draw(screen, controls_screen, scene)
         elif game_state == GAME_OVER:
-            # Semi-transparent overlay
-            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 128))
-            screen.blit(overlay, (0, 0))
-            
-            draw_text("GAME OVER", 64, RED, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 4)
-            draw_text(f"Final Score: {score}", 48, WHITE, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50)
-            draw_text(f"Levels Completed: {level-1}", 36, WHITE, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
-            draw_text("Press ENTER to play again", 36, WHITE, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 50)
-            
-            # Draw back button
-            back_button.draw(screen)
+            redrawn = compositor.draw(screen, game_over_screen, scene, (game.score, game.level - 1))
         
-        # Update the display
-        pygame.display.flip()
+        if show_profiler:
+            profiler_overlay.draw(screen, profiler)
+        profiler.mark('screens')
         
-        # Cap the frame rate
-        clock.tick(FPS)
+        if redrawn:
+            if capture:
+                capture.capture(screen)
+                profiler.mark('capture')
+            
+            # Update the display
+            present()
+            profiler.mark('present')
+            
+            # Cap the frame rate
+            clock.tick(fps)
+        else:
+            # Nothing changed, keep showing the last frame and poll slowly
+            clock.tick(IDLE_FPS)
+        profiler.mark('wait')
+        profiler.end_frame()
     
+    if profile_path:
+        profiler.export(profile_path)
+        print(f"Wrote {len(profiler.history)} frame timings to {profile_path}")
+    if recorder:
+        recorder.save(record_path, game.state_digest())
+    if capture:
+        capture.close()
+        print(capture_summary(capture))
+    prefetcher.shutdown()
+    level_generator.shutdown()
     pygame.quit()
     sys.exit()
 
+def capture_summary(capture):
+    stats = capture.stats()
+    return f"Captured {stats['written']} frames to {capture.path}, {stats['dropped']} dropped"
+
+# --level-width for the command line, levels are at least one screen wide
+def parse_level_width(text):
+    width = int(text)
+    if width < SCREEN_WIDTH:
+        raise argparse.ArgumentTypeError(f"level width must be at least {SCREEN_WIDTH}, got {width}")
+    return width
+
+# Counts for the command line that have to be at least 1
+def parse_positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+# "1920x1080" to (1920, 1080), for the command line
+def parse_size(text):
+    try:
+        width, height = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}") from None
+    return width, height
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Enhanced 2D Platformer")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only redraw and update the screen regions that changed")
+    parser.add_argument("--tick-rate", type=parse_positive_int, default=TICK_RATE,
+                        help="simulation ticks per second (default: %(default)s)")
+    parser.add_argument("--fps", type=int, default=FPS,
+                        help="rendered frames per second, 0 for uncapped (default: %(default)s)")
+    parser.add_argument("--interpolate", action="store_true",
+                        help="draw moving sprites interpolated between simulation ticks")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print how long initialisation, display setup and asset loading took")
+    parser.add_argument("--profile", action="store_true",
+                        help="show the frame profiler overlay from the start (toggle with F3)")
+    parser.add_argument("--profile-out", metavar="FILE",
+                        help="write per-frame phase timings to FILE on exit (.json for a Chrome trace, else CSV)")
+    parser.add_argument("--generator-processes", type=int, default=1,
+                        help="processes checking candidate layouts of generated levels, only worth it for very "
+                             "wide levels on a multi-core machine (default: %(default)s)")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="simulate enemies and coins as NumPy arrays")
+    parser.add_argument("--scale", choices=SCALE_MODES, default='none',
+                        help="fit the 800x600 game to a bigger window: scaled (by SDL), fast or smooth "
+                             "(one software scaling pass per frame) (default: %(default)s)")
+    parser.add_argument("--window-size", type=parse_size, metavar="WxH",
+                        help="window size for --scale fast/smooth (default: the desktop size)")
+    parser.add_argument("--fullscreen", action="store_true", help="run fullscreen")
+    parser.add_argument("--level-width", type=parse_level_width, default=SCREEN_WIDTH,
+                        help="width in pixels of the generated levels, wider levels scroll (default: %(default)s)")
+    parser.add_argument("--level-dir", metavar="DIR",
+                        help="play the levels stored in DIR (see level_format.py), generate the others")
+    parser.add_argument("--seed", type=int,
+                        help="seed for level generation of the first session (default: random)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the seed and per-tick input of the first session to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="re-simulate a recorded session, in real time or with --headless at full speed")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the simulation without a window and report ticks per second")
+    parser.add_argument("--ticks", type=int, default=3600,
+                        help="maximum ticks per headless session (default: %(default)s)")
+    parser.add_argument("--sessions", type=int, default=1,
+                        help="number of headless sessions to run (default: %(default)s)")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="capture the frames to PATH: a raw RGB24 stream if it ends in .rgb, "
+                             "else a directory of PNGs")
+    parser.add_argument("--capture-every", type=parse_positive_int, default=1,
+                        help="with --headless, capture every this many ticks (default: %(default)s)")
+    parser.add_argument("--capture-buffers", type=parse_positive_int, default=CAPTURE_BUFFERS,
+                        help="frames that can wait for the capture writer before frames are dropped "
+                             "(default: %(default)s)")
+    parser.add_argument("--input-script",
+                        help='scripted headless input, e.g. "R*120,RJ*1,*30" (default: random input)')
+    args = parser.parse_args()
+    if args.vectorized and np is None:
+        print("NumPy is not installed, --vectorized is ignored")
+    level_generator.set_processes(args.generator_processes)
+    if args.headless and args.capture:
+        # Captured frames are drawn offscreen, no window is opened
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    
+    if args.headless and args.replay:
+        capture = FrameCapture(args.capture, init_game(), args.capture_buffers) if args.capture else None
+        result = run_replay(args.replay, args.vectorized, args.level_dir, capture, args.capture_every)
+        print(f"Replayed {result['ticks']} ticks in {result['seconds']:.2f}s, "
+              f"{result['ticks_per_second']:.0f} ticks/s, score {result['score']}, "
+              f"{'matches' if result['matches'] else 'DOES NOT match'} the recording")
+        if capture:
+            capture.close()
+            print(capture_summary(capture))
+        sys.exit(0 if result['matches'] else 1)
+    elif args.headless:
+        total_ticks = 0
+        total_seconds = 0.0
+        for session in range(args.sessions):
+            if args.input_script:
+                input_source = ScriptedInput(args.input_script)
+            else:
+                input_source = RandomInput(seed=session)
+            seed = args.seed + session if args.seed is not None else random.getrandbits(64)
+            recorder = None
+            if args.record:
+                record_path = args.record
+                if args.sessions > 1:
+                    root, ext = os.path.splitext(args.record)
+                    record_path = f"{root}-{session + 1}{ext}"
+                recorder = InputRecorder(seed, args.tick_rate, level_width=args.level_width)
+            capture = None
+            if args.capture:
+                capture_path = args.capture
+                if args.sessions > 1:
+                    root, ext = os.path.splitext(args.capture)
+                    capture_path = f"{root}-{session + 1}{ext}"
+                capture = FrameCapture(capture_path, init_game(), args.capture_buffers)
+            result = run_headless(args.ticks, input_source, tick_rate=args.tick_rate,
+                                  seed=seed, recorder=recorder, vectorized=args.vectorized,
+                                  level_width=args.level_width, level_dir=args.level_dir,
+                                  capture=capture, capture_every=args.capture_every)
+            if recorder:
+                recorder.save(record_path, result['digest'])
+            total_ticks += result['ticks']
+            total_seconds += result['seconds']
+            print(f"Session {session + 1}: {result['ticks']} ticks, score {result['score']}, "
+                  f"level {result['level']}, lives {result['lives']}, "
+                  f"{result['ticks_per_second']:.0f} ticks/s")
+            if capture:
+                capture.close()
+                print(capture_summary(capture))
+        if total_seconds > 0:
+            print(f"Total: {total_ticks} ticks in {total_seconds:.2f}s, "
+                  f"{total_ticks / total_seconds:.0f} ticks/s")
+        pool = sprite_pool.stats()
+        print(f"Sprite pool: {pool['created']} created, {pool['reused']} reused, {pool['free']} free")
+        generator = level_generator.stats()
+        print(f"Level generator: {generator['generated']} levels, {generator['rejected']} candidates rejected, "
+              f"{generator['repaired']} repaired, {generator['hits']} cache hits")
+    else:
+        main(dirty_rects=args.dirty_rects, tick_rate=args.tick_rate, fps=args.fps,
+             interpolate=args.interpolate, report_startup=args.startup_report,
+             seed=args.seed, record_path=args.record, replay_path=args.replay,
+             show_profiler=args.profile, profile_path=args.profile_out, vectorized=args.vectorized,
+             level_width=args.level_width, level_dir=args.level_dir, scale_mode=args.scale,
+             window_size=args.window_size, fullscreen=args.fullscreen, capture_path=args.capture,
+             capture_buffers=args.capture_buffers)
@@ -0,0 +1,107 @@
+import csv
+import json
+import time
+from collections import deque
+
+# Frames kept for the rolling averages and percentile
+PROFILER_WINDOW = 240
+
+# Nearest-rank percentile of a sorted list of seconds, in milliseconds
+def percentile(sorted_times, percent):
+    if not sorted_times:
+        return 0.0
+    index = min(len(sorted_times) - 1, int(len(sorted_times) * percent / 100))
+    return sorted_times[index] * 1000
+
+# Times the phases of each frame. Call begin_frame() at the top of the frame,
+# mark(phase) at the end of every phase (repeated phases add up, e.g. several
+# simulation ticks in one frame) and end_frame() once the frame is done.
+class FrameProfiler:
+    def __init__(self, window=PROFILER_WINDOW, keep_history=False):
+        self.frame_times = deque(maxlen=window)
+        self.phase_times = deque(maxlen=window)
+        # Every frame as (start, total, phases), only kept when exporting
+        self.keep_history = keep_history
+        self.history = []
+        self.origin = time.perf_counter()
+        self.frame_start = None
+        self.last_mark = None
+        self.phases = None
+
+    def begin_frame(self):
+        now = time.perf_counter()
+        self.frame_start = now
+        self.last_mark = now
+        self.phases = {}
+
+    def mark(self, phase):
+        if self.phases is None:
+            return
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self):
+        if self.phases is None:
+            return
+        total = time.perf_counter() - self.frame_start
+        self.frame_times.append(total)
+        self.phase_times.append(self.phases)
+        if self.keep_history:
+            self.history.append((self.frame_start - self.origin, total, self.phases))
+        self.phases = None
+
+    # Mean milliseconds per frame of every phase over the rolling window
+    def averages(self):
+        totals = {}
+        for phases in self.phase_times:
+            for phase, seconds in phases.items():
+                totals[phase] = totals.get(phase, 0.0) + seconds
+        count = len(self.phase_times) or 1
+        return {phase: seconds * 1000 / count for phase, seconds in totals.items()}
+
+    def mean_frame_time(self):
+        if not self.frame_times:
+            return 0.0
+        return sum(self.frame_times) * 1000 / len(self.frame_times)
+
+    def percentile(self, percent):
+        return percentile(sorted(self.frame_times), percent)
+
+    # Write the frame history as a Chrome trace (.json) or as CSV
+    def export(self, path):
+        if path.endswith('.json'):
+            self.export_chrome_trace(path)
+        else:
+            self.export_csv(path)
+
+    def export_csv(self, path):
+        phase_names = []
+        for _, _, phases in self.history:
+            for phase in phases:
+                if phase not in phase_names:
+                    phase_names.append(phase)
+
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'start_ms', 'total_ms'] + [f"{phase}_ms" for phase in phase_names])
+            for frame, (start, total, phases) in enumerate(self.history):
+                row = [frame, f"{start * 1000:.3f}", f"{total * 1000:.3f}"]
+                row.extend(f"{phases.get(phase, 0.0) * 1000:.3f}" for phase in phase_names)
+                writer.writerow(row)
+
+    def export_chrome_trace(self, path):
+        # Phases are laid out back to back inside their frame, in first-seen order
+        events = []
+        for frame, (start, total, phases) in enumerate(self.history):
+            start_us = start * 1e6
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': start_us, 'dur': total * 1e6, 'args': {'frame': frame}})
+            offset = start_us
+            for phase, seconds in phases.items():
+                events.append({'name': phase, 'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': offset, 'dur': seconds * 1e6})
+                offset += seconds * 1e6
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,106 @@
+import bisect
+import math
+
+# Where a jump can take the player, worked out once from the movement
+# constants by stepping the same physics as Player.update() at the base tick.
+# Heights are upward pixels relative to the top of the platform jumped from.
+class JumpEnvelope:
+    def __init__(self, gravity, jump_strength, speed, terminal_velocity, player_size, max_drop):
+        self.speed = speed
+        self.player_width, self.player_height = player_size
+        self.max_drop = max_drop
+
+        # Height after every tick of a jump, until it has dropped max_drop
+        heights = []
+        y = 0.0
+        velocity = jump_strength
+        while velocity <= 0 or -y >= -max_drop:
+            velocity = min(velocity + gravity, terminal_velocity)
+            y += velocity
+            heights.append(-y)
+        self.apex = max(heights)
+        apex_tick = heights.index(self.apex)
+
+        # For every whole height from -max_drop up to the apex: the sideways
+        # distance covered by the tick the feet come down through it (landing
+        # on a platform top there) and by the tick before (touching something
+        # at that height)
+        self.landing = []
+        self.touching = []
+        tick = len(heights) - 1
+        for height in range(-max_drop, math.floor(self.apex) + 1):
+            while tick - 1 > apex_tick and heights[tick - 1] <= height:
+                tick -= 1
+            self.landing.append(speed * (tick + 1))
+            self.touching.append(speed * tick)
+        self.max_reach = self.landing[0]
+
+    # Sideways pixels the player can cover landing on a platform whose top is
+    # height above the one jumped from, None if it is too high
+    def landing_reach(self, height):
+        height = math.ceil(height)
+        if height > self.apex:
+            return None
+        return self.landing[max(height, -self.max_drop) + self.max_drop]
+
+    # Sideways pixels the player can cover with its top edge at least height
+    # above where it was standing, None if it is too high
+    def touching_reach(self, height):
+        height = math.ceil(height)
+        if height > self.apex:
+            return None
+        return self.touching[max(height, -self.max_drop) + self.max_drop]
+
+# Sideways pixels the player has to move to go from overlapping the span
+# [left1, right1) to overlapping [left2, right2)
+def travel(left1, right1, left2, right2, player_width):
+    return max(0, left2 - right1 - player_width + 2, left1 - right2 - player_width + 2)
+
+# Which platforms and coins the player can get to from the start platforms,
+# as two sets of indices. Platforms are (x, y, width, height) and coins
+# (x, y, width, height) rects. A platform is reachable when a jump (or a walk
+# off the edge) from a reachable platform can land on it; a coin when a jump
+# from a reachable platform can touch it. Platforms in the way of a jump are
+# ignored, so a level that passes may still need some care to clear.
+def reachable(envelope, platforms, coins, start):
+    player_width = envelope.player_width
+    player_height = envelope.player_height
+    # Platforms sorted by left edge, so only the ones within a jump of a
+    # platform are looked at
+    order = sorted(range(len(platforms)), key=lambda i: platforms[i][0])
+    lefts = [platforms[i][0] for i in order]
+    widest = max(platform[2] for platform in platforms)
+    margin = envelope.max_reach + player_width + widest
+
+    found = set(start)
+    stack = list(start)
+    while stack:
+        x, y, width, _ = platforms[stack.pop()]
+        for i in order[bisect.bisect_left(lefts, x - margin):bisect.bisect_right(lefts, x + width + margin)]:
+            if i in found:
+                continue
+            other_x, other_y, other_width, _ = platforms[i]
+            reach = envelope.landing_reach(y - other_y)
+            if reach is not None and travel(x, x + width, other_x, other_x + other_width, player_width) <= reach:
+                found.add(i)
+                stack.append(i)
+
+    # Coins sorted the same way, checked against every reachable platform
+    coin_order = sorted(range(len(coins)), key=lambda i: coins[i][0])
+    coin_lefts = [coins[i][0] for i in coin_order]
+    margin = envelope.max_reach + player_width
+    collected = set()
+    for platform in found:
+        x, y, width, _ = platforms[platform]
+        for i in coin_order[bisect.bisect_left(coin_lefts, x - margin):bisect.bisect_right(coin_lefts, x + width + margin)]:
+            if i in collected:
+                continue
+            coin_x, coin_y, coin_width, coin_height = coins[i]
+            # The coin has to be above the feet, and the top of the player
+            # has to come up past the coin's bottom edge
+            if coin_y >= y:
+                continue
+            reach = envelope.touching_reach(y - player_height - (coin_y + coin_height) + 1)
+            if reach is not None and travel(x, x + width, coin_x, coin_x + coin_width, player_width) <= reach:
+                collected.add(i)
+    return found, collected
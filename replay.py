@@ -0,0 +1,101 @@
+import struct
+
+# Replay files: a header with everything needed to rebuild the session, the
+# per-tick input bits run-length encoded, and a footer with the tick count and
+# a digest of the final game state to check a replay against.
+REPLAY_MAGIC = b'PFRP'
+REPLAY_VERSION = 5
+# magic, version, tick rate, starting level, RNG seed, level width
+HEADER_FORMAT = struct.Struct('<4sHHIQI')
+# input bits, number of consecutive ticks with those bits (0 ends the runs)
+RUN_FORMAT = struct.Struct('<BH')
+MAX_RUN = 0xFFFF
+# total ticks, final state digest
+FOOTER_FORMAT = struct.Struct('<QQ')
+
+class ReplayError(Exception):
+    pass
+
+# Collects the input bits of every simulation tick of one session
+class InputRecorder:
+    def __init__(self, seed, tick_rate, level=1, level_width=800):
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.level = level
+        self.level_width = level_width
+        self.runs = []
+        self.ticks = 0
+
+    def record(self, inputs):
+        runs = self.runs
+        if runs and runs[-1][0] == inputs and runs[-1][1] < MAX_RUN:
+            runs[-1][1] += 1
+        else:
+            runs.append([inputs, 1])
+        self.ticks += 1
+
+    def save(self, path, digest):
+        with open(path, 'wb') as f:
+            f.write(HEADER_FORMAT.pack(REPLAY_MAGIC, REPLAY_VERSION, self.tick_rate,
+                                       self.level, self.seed, self.level_width))
+            f.write(b''.join(RUN_FORMAT.pack(inputs, count) for inputs, count in self.runs))
+            f.write(RUN_FORMAT.pack(0, 0))
+            f.write(FOOTER_FORMAT.pack(self.ticks, digest))
+
+# A loaded replay. Works as an input source: called with the Game before each
+# tick, it returns the input bits recorded for that tick.
+class InputReplay:
+    def __init__(self, seed, tick_rate, level, runs, ticks, digest, level_width=800):
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.level = level
+        self.level_width = level_width
+        self.runs = runs
+        self.ticks = ticks
+        self.digest = digest
+        self.rewind()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            magic, version, tick_rate, level, seed, level_width = HEADER_FORMAT.unpack_from(data, 0)
+        except struct.error:
+            raise ReplayError(f"{path} is too short to be a replay") from None
+        if magic != REPLAY_MAGIC:
+            raise ReplayError(f"{path} is not a replay file")
+        if version != REPLAY_VERSION:
+            raise ReplayError(f"{path} has unsupported replay version {version}")
+
+        runs = []
+        offset = HEADER_FORMAT.size
+        try:
+            while True:
+                inputs, count = RUN_FORMAT.unpack_from(data, offset)
+                offset += RUN_FORMAT.size
+                if count == 0:
+                    break
+                runs.append((inputs, count))
+            ticks, digest = FOOTER_FORMAT.unpack_from(data, offset)
+        except struct.error:
+            raise ReplayError(f"{path} is truncated") from None
+        return cls(seed, tick_rate, level, runs, ticks, digest, level_width)
+
+    def rewind(self):
+        self.run_index = 0
+        self.run_left = self.runs[0][1] if self.runs else 0
+
+    def finished(self):
+        return self.run_index >= len(self.runs)
+
+    def __call__(self, game):
+        if self.finished():
+            return 0
+        inputs = self.runs[self.run_index][0]
+        self.run_left -= 1
+        if self.run_left == 0:
+            self.run_index += 1
+            if self.run_index < len(self.runs):
+                self.run_left = self.runs[self.run_index][1]
+        return inputs
@@ -0,0 +1,268 @@
+import os
+import time
+import struct
+import random
+import asyncio
+import argparse
+from collections import deque
+
+# The server never opens a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from platformer_game import Game, parse_level_width, parse_positive_int, SCREEN_WIDTH, TICK_RATE
+from profiler import percentile
+
+# Every connection is one session. The client sends INPUT_FORMAT records
+# whenever its input bits change; the server answers with a WELCOME message
+# and then a SNAPSHOT message every snapshot tick. Server messages are a
+# MESSAGE_HEADER followed by the body.
+MESSAGE_HEADER = struct.Struct('<IB')
+MESSAGE_WELCOME = 1
+MESSAGE_SNAPSHOT = 2
+# input sequence number, input bits
+INPUT_FORMAT = struct.Struct('<IB')
+# session id, seed, tick rate, level width
+WELCOME_FORMAT = struct.Struct('<IQHI')
+# tick, last input sequence applied, score, lives, level, flags, changed entities, removed entities
+SNAPSHOT_FORMAT = struct.Struct('<IIIbHBHH')
+# kind, flags, id, x, y, width, height
+ENTITY_FORMAT = struct.Struct('<BBIihHH')
+# kind, id
+REMOVED_FORMAT = struct.Struct('<BI')
+
+# Snapshot flags
+SNAPSHOT_GAME_OVER = 1
+# Entity flags
+ENTITY_FACING_LEFT = 1
+
+ENTITY_PLAYER = 0
+ENTITY_PLATFORM = 1
+ENTITY_COIN = 2
+ENTITY_ENEMY = 3
+
+# Snapshots are skipped (and the next one carries the combined delta) while
+# more than this many bytes wait to be sent to a slow client
+MAX_PENDING_BYTES = 256 * 1024
+# Ticks kept for the server's timing statistics
+STATS_WINDOW = 600
+
+def encode_message(kind, body):
+    return MESSAGE_HEADER.pack(len(body), kind) + body
+
+# Everything a client needs to draw the game, (kind, id) -> (flags, x, y,
+# width, height). Only the loaded chunks of the level are included. Enemies
+# have no level ids, they are numbered by chunk and position within it.
+def entity_states(game):
+    game.sync_sprites()
+    world = game.world
+    player = game.player
+    rect = player.rect
+    states = {(ENTITY_PLAYER, 0): (0 if player.facing_right else ENTITY_FACING_LEFT,
+                                   rect.x, rect.y, rect.width, rect.height)}
+    for platform_id, (platform, _) in world.platform_refs.items():
+        rect = platform.rect
+        states[(ENTITY_PLATFORM, platform_id)] = (0, rect.x, rect.y, rect.width, rect.height)
+    for coin, coin_id in world.coin_ids.items():
+        rect = coin.rect
+        states[(ENTITY_COIN, coin_id)] = (0, rect.x, rect.y, rect.width, rect.height)
+    for index, (_, enemies, _) in world.chunks.items():
+        for i, enemy in enumerate(enemies):
+            rect = enemy.rect
+            states[(ENTITY_ENEMY, index << 16 | i)] = (0 if enemy.facing_right else ENTITY_FACING_LEFT,
+                                                       rect.x, rect.y, rect.width, rect.height)
+    return states
+
+# Snapshot body holding only the entities that differ from previous, the
+# states last sent to the client
+def encode_snapshot(game, ack, previous, states):
+    changed = [ENTITY_FORMAT.pack(kind, state[0], entity_id, *state[1:])
+               for (kind, entity_id), state in states.items() if previous.get((kind, entity_id)) != state]
+    removed = [REMOVED_FORMAT.pack(*key) for key in previous if key not in states]
+    flags = SNAPSHOT_GAME_OVER if game.game_over else 0
+    header = SNAPSHOT_FORMAT.pack(game.ticks, ack, game.score, game.lives, game.level, flags,
+                                  len(changed), len(removed))
+    return b''.join([header, *changed, *removed])
+
+# Apply a snapshot body to the client's entities, a dict like the one from
+# entity_states(). Returns the snapshot header as a tuple.
+def apply_snapshot(entities, body):
+    header = SNAPSHOT_FORMAT.unpack_from(body, 0)
+    changed, removed = header[-2:]
+    offset = SNAPSHOT_FORMAT.size
+    for kind, flags, entity_id, x, y, width, height in ENTITY_FORMAT.iter_unpack(
+            body[offset:offset + ENTITY_FORMAT.size * changed]):
+        entities[(kind, entity_id)] = (flags, x, y, width, height)
+    offset += ENTITY_FORMAT.size * changed
+    for key in REMOVED_FORMAT.iter_unpack(body[offset:offset + REMOVED_FORMAT.size * removed]):
+        entities.pop(key, None)
+    return header
+
+# One connected client and its game
+class Session:
+    def __init__(self, session_id, game, writer):
+        self.id = session_id
+        self.game = game
+        self.writer = writer
+        # Held until the client sends other bits
+        self.inputs = 0
+        self.ack = 0
+        # Entity states the client has, see entity_states()
+        self.sent = {}
+        self.bytes_sent = 0
+        self.skipped = 0
+
+# Hosts many independent sessions in one asyncio loop. All games advance
+# together at tick_rate; every snapshot_every ticks each client gets a delta
+# snapshot of what changed since the last one it was sent.
+class GameServer:
+    def __init__(self, tick_rate=TICK_RATE, snapshot_every=1, seed=None, level_width=SCREEN_WIDTH,
+                 vectorized=False, max_sessions=None):
+        self.tick_rate = tick_rate
+        self.snapshot_every = snapshot_every
+        # Session i plays seed + i, or a random seed without a server seed
+        self.seed = seed
+        self.level_width = level_width
+        self.vectorized = vectorized
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.next_id = 0
+        self.ticks = 0
+        self.tick_times = deque(maxlen=STATS_WINDOW)
+        self.overruns = 0
+        self.bytes_sent = 0
+
+    async def handle_client(self, reader, writer):
+        if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+            writer.close()
+            return
+        session_id = self.next_id
+        self.next_id += 1
+        seed = random.getrandbits(64) if self.seed is None else self.seed + session_id
+        game = Game(tick_rate=self.tick_rate, seed=seed, vectorized=self.vectorized,
+                    level_width=self.level_width)
+        session = Session(session_id, game, writer)
+        writer.write(encode_message(MESSAGE_WELCOME, WELCOME_FORMAT.pack(session_id, seed, self.tick_rate,
+                                                                         self.level_width)))
+        self.sessions[session_id] = session
+        try:
+            while True:
+                session.ack, session.inputs = INPUT_FORMAT.unpack(await reader.readexactly(INPUT_FORMAT.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.end_session(session)
+
+    def end_session(self, session):
+        if self.sessions.pop(session.id, None) is None:
+            return
+        session.game.release_level()
+        session.writer.close()
+
+    # Step every game once and send the snapshots that are due
+    def tick(self):
+        self.ticks += 1
+        send = self.ticks % self.snapshot_every == 0
+        for session in list(self.sessions.values()):
+            game = session.game
+            game.step(session.inputs)
+            if not (send or game.game_over):
+                continue
+            if session.writer.transport.get_write_buffer_size() > MAX_PENDING_BYTES and not game.game_over:
+                session.skipped += 1
+                continue
+            states = entity_states(game)
+            message = encode_message(MESSAGE_SNAPSHOT, encode_snapshot(game, session.ack, session.sent, states))
+            session.sent = states
+            session.writer.write(message)
+            session.bytes_sent += len(message)
+            self.bytes_sent += len(message)
+            if game.game_over:
+                self.end_session(session)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        deadline = loop.time()
+        while True:
+            start = time.perf_counter()
+            self.tick()
+            self.tick_times.append(time.perf_counter() - start)
+            deadline += interval
+            delay = deadline - loop.time()
+            if delay < 0:
+                self.overruns += 1
+                # Drop the missed ticks rather than running a burst to catch up
+                if delay < -interval:
+                    deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        times = sorted(self.tick_times)
+        mean = sum(times) / len(times) if times else 0.0
+        return {
+            'sessions': len(self.sessions),
+            'ticks': self.ticks,
+            'tick_mean_ms': mean * 1000,
+            'tick_p99_ms': percentile(times, 99),
+            # Share of the tick interval spent stepping and encoding
+            'load': mean * self.tick_rate,
+            'overruns': self.overruns,
+            'bytes_sent': self.bytes_sent,
+        }
+
+    async def report(self, every):
+        bytes_sent = self.bytes_sent
+        while True:
+            await asyncio.sleep(every)
+            stats = self.stats()
+            line = (f"{stats['sessions']} sessions, tick {stats['tick_mean_ms']:.2f} ms "
+                    f"(p99 {stats['tick_p99_ms']:.2f} ms, {stats['load']:.0%} of the tick), "
+                    f"{stats['overruns']} overruns, {(stats['bytes_sent'] - bytes_sent) / every / 1024:.0f} KB/s")
+            # One core keeps up while a tick takes less than the tick interval
+            if stats['sessions'] and stats['load'] > 0:
+                line += f", ~{stats['sessions'] / stats['load']:.0f} sessions/core"
+            print(line, flush=True)
+            bytes_sent = stats['bytes_sent']
+
+async def serve(server, host, port, unix_path, report_every):
+    if unix_path:
+        listener = await asyncio.start_unix_server(server.handle_client, unix_path)
+        print(f"Listening on {unix_path}", flush=True)
+    else:
+        listener = await asyncio.start_server(server.handle_client, host, port)
+        print(f"Listening on {host}:{port}", flush=True)
+    tasks = [asyncio.create_task(server.run())]
+    if report_every:
+        tasks.append(asyncio.create_task(server.report(report_every)))
+    async with listener:
+        await asyncio.gather(*tasks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many headless platformer sessions over TCP or a Unix socket")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=7777, help="TCP port to listen on (default: %(default)s)")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--tick-rate", type=parse_positive_int, default=TICK_RATE,
+                        help="simulation ticks per second (default: %(default)s)")
+    parser.add_argument("--snapshot-every", type=int, default=1,
+                        help="ticks between snapshots (default: %(default)s)")
+    parser.add_argument("--seed", type=int, help="seed of the first session, the others follow it")
+    parser.add_argument("--level-width", type=parse_level_width, default=SCREEN_WIDTH,
+                        help="width of the generated levels from level 3 on (default: %(default)s)")
+    parser.add_argument("--vectorized", action="store_true", help="simulate enemies and coins as NumPy arrays")
+    parser.add_argument("--max-sessions", type=int, help="refuse connections beyond this many sessions")
+    parser.add_argument("--report", type=float, default=5.0,
+                        help="seconds between statistics lines, 0 for none (default: %(default)s)")
+    args = parser.parse_args()
+
+    server = GameServer(args.tick_rate, args.snapshot_every, args.seed, args.level_width, args.vectorized,
+                        args.max_sessions)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix, args.report))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,93 @@
 import pygame
 import os
+import sys
+import json
+import hashlib
 from player import create_player_sprite
 from platform import create_platform_sprite
 from coin import create_coin_sprite
 from enemy import create_enemy_sprite
 
-def main():
+# Packed sprite sheet and the index of named rects inside it
+ATLAS_IMAGE = os.path.join('sprites', 'atlas.png')
+ATLAS_INDEX = os.path.join('sprites', 'atlas.json')
+ATLAS_WIDTH = 256
+# Transparent gap between packed sprites so scaling never bleeds a neighbour in
+ATLAS_PADDING = 1
+
+# The sprites only change when one of these files changes
+GENERATOR_FILES = ['player.py', 'platform.py', 'coin.py', 'enemy.py', 'generate_sprites.py']
+
+def source_hash():
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for filename in GENERATOR_FILES:
+        with open(os.path.join(here, filename), 'rb') as f:
+            digest.update(filename.encode())
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def is_up_to_date(digest):
+    if not os.path.exists(ATLAS_IMAGE):
+        return False
+    try:
+        with open(ATLAS_INDEX) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return index.get('source_hash') == digest
+
+# Shelf packing: tallest sprites first, left to right in rows of ATLAS_WIDTH
+def pack_sprites(sprites):
+    rects = {}
+    x = y = row_height = 0
+    for name in sorted(sprites, key=lambda name: -sprites[name].get_height()):
+        width, height = sprites[name].get_size()
+        if x and x + width > ATLAS_WIDTH:
+            x = 0
+            y += row_height + ATLAS_PADDING
+            row_height = 0
+        rects[name] = (x, y, width, height)
+        x += width + ATLAS_PADDING
+        row_height = max(row_height, height)
+    return rects, y + row_height
+
+def create_atlas(sprites, digest):
+    rects, height = pack_sprites(sprites)
+    atlas = pygame.Surface((ATLAS_WIDTH, height), pygame.SRCALPHA)
+    for name, rect in rects.items():
+        atlas.blit(sprites[name], rect[:2])
+    pygame.image.save(atlas, ATLAS_IMAGE)
+
+    index = {'source_hash': digest, 'size': [ATLAS_WIDTH, height], 'sprites': rects}
+    with open(ATLAS_INDEX, 'w') as f:
+        json.dump(index, f, separators=(',', ':'), sort_keys=True)
+    return atlas
+
+def main(force=False):
     pygame.init()
-    
+
     # Create sprites directory if it doesn't exist
     if not os.path.exists('sprites'):
         os.makedirs('sprites')
-    
+
+    digest = source_hash()
+    if not force and is_up_to_date(digest):
+        print("Sprites are up to date, nothing to generate (use --force to regenerate)")
+        pygame.quit()
+        return
+
     # Generate all sprites
-    create_player_sprite()
-    create_platform_sprite()
-    create_coin_sprite()
-    create_enemy_sprite()
-    
+    sprites = {
+        'player': create_player_sprite(),
+        'platform': create_platform_sprite(),
+        'coin': create_coin_sprite(),
+        'enemy': create_enemy_sprite(),
+    }
+    create_atlas(sprites, digest)
+
     print("All sprites generated successfully!")
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
+    main(force='--force' in sys.argv[1:])